@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shift_scheduler import SHIFT_LABELS, ShiftScheduler, default_shift_types
+
+DEFAULT_WEIGHTS = [0.2, 0.3, 0.3, 0.2]
+START = datetime(2023, 11, 2, 4, 40, 43)
+
+def generate_preferences(employee_count, day_count, weights=DEFAULT_WEIGHTS, seed=0):
+    # Googleフォームの出力と同じ列構成 (タイムスタンプ, 名前, メールアドレス, 希望日 [N日]) で作る
+    rng = np.random.default_rng(seed)
+    probabilities = np.asarray(weights, dtype=float)
+    probabilities = probabilities / probabilities.sum()
+    codes = rng.choice(len(SHIFT_LABELS), size=(employee_count, day_count), p=probabilities)
+    labels = np.array(SHIFT_LABELS, dtype=object)[codes]
+    offsets = np.sort(rng.integers(0, 7 * 24 * 3600, size=employee_count))
+    width = len(str(employee_count))
+    preferences = pd.DataFrame({
+        'タイムスタンプ': [f'{t:%Y/%m/%d} {t.hour}:{t:%M:%S}' for t in (START + timedelta(seconds=int(offset)) for offset in offsets)],
+        '名前': [f'従業員{i:0{width}d}' for i in range(1, employee_count + 1)],
+        'メールアドレス': [f'staff{i:0{width}d}@example.com' for i in range(1, employee_count + 1)],
+    })
+    # 1か月を超える場合は「11月1日」のように月付きの列名にする
+    first_day = START.date().replace(day=1)
+    dates = [first_day + timedelta(days=offset) for offset in range(day_count)]
+    day_labels = [f'{date.day}日' for date in dates] if day_count <= 31 else [f'{date.month}月{date.day}日' for date in dates]
+    days = pd.DataFrame(labels, columns=[f'希望日 [{label}]' for label in day_labels])
+    return pd.concat([preferences, days], axis=1)
+
+def measure(func, trace_memory=False):
+    if trace_memory:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = func()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, wall, cpu, peak
+
+def run_phases(input_path, output_path, early_shift_count, late_shift_count, solver, trace_memory):
+    scheduler = ShiftScheduler(start_date=date(START.year, START.month, 1))
+    preferences, load_wall, load_cpu, load_peak = measure(lambda: scheduler.load_preferences(input_path), trace_memory)
+    _, create_wall, create_cpu, create_peak = measure(lambda: scheduler.create_shift_schedule(preferences, default_shift_types(early_shift_count, late_shift_count), solver=solver, seed=0), trace_memory)
+    _, save_wall, save_cpu, save_peak = measure(lambda: scheduler.save_schedule(output_path), trace_memory)
+    return {
+        'load_preferences': {'wall': load_wall, 'cpu': load_cpu, 'peak_bytes': load_peak},
+        'create_shift_schedule': {'wall': create_wall, 'cpu': create_cpu, 'peak_bytes': create_peak},
+        'save_schedule': {'wall': save_wall, 'cpu': save_cpu, 'peak_bytes': save_peak},
+    }
+
+def run_case(employee_count, day_count, weights, early_shift_count, late_shift_count, solver, repeat, seed, work_dir):
+    input_path = os.path.join(work_dir, f'preferences_{employee_count}x{day_count}.csv')
+    output_path = os.path.join(work_dir, f'schedule_{employee_count}x{day_count}.csv')
+    generate_preferences(employee_count, day_count, weights, seed).to_csv(input_path, index=False)
+    timings = [run_phases(input_path, output_path, early_shift_count, late_shift_count, solver, False) for _ in range(repeat)]
+    memory = run_phases(input_path, output_path, early_shift_count, late_shift_count, solver, True)
+    phases = {}
+    for phase in memory:
+        phases[phase] = {
+            'wall': min(timing[phase]['wall'] for timing in timings),
+            'cpu': min(timing[phase]['cpu'] for timing in timings),
+            'peak_bytes': memory[phase]['peak_bytes'],
+        }
+    return {
+        'employees': employee_count,
+        'days': day_count,
+        'weights': dict(zip(SHIFT_LABELS, weights)),
+        'early_shift_count': early_shift_count,
+        'late_shift_count': late_shift_count,
+        'solver': solver,
+        'repeat': repeat,
+        'input_bytes': os.path.getsize(input_path),
+        'phases': phases,
+    }
+
+def compare_results(results, baseline, tolerance):
+    baseline_cases = {(case['employees'], case['days'], case['solver']): case for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        previous = baseline_cases.get((case['employees'], case['days'], case['solver']))
+        if previous is None:
+            continue
+        for phase, timing in case['phases'].items():
+            previous_wall = previous['phases'][phase]['wall']
+            if previous_wall > 0 and timing['wall'] > previous_wall * (1 + tolerance):
+                regressions.append(f"{case['employees']}x{case['days']} {phase}: {previous_wall:.4f}s -> {timing['wall']:.4f}s")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="シフト作成処理のベンチマーク。合成した希望シフトCSVで各処理の時間とメモリを計測します。")
+    parser.add_argument('--employees', type=int, nargs='+', default=[10, 100, 1000], help="従業員数 (複数指定可)")
+    parser.add_argument('--days', type=int, nargs='+', default=[31], help="日数 (複数指定可, 1〜366)")
+    parser.add_argument('--weights', type=float, nargs=len(SHIFT_LABELS), default=DEFAULT_WEIGHTS, metavar='W', help=f"希望の出現比率 ({'/'.join(SHIFT_LABELS)} の順)")
+    parser.add_argument('--early', type=int, default=2, help="早番の必要人数")
+    parser.add_argument('--late', type=int, default=2, help="遅番の必要人数")
+    parser.add_argument('--solver', default='random', help="割り当て方法")
+    parser.add_argument('--repeat', type=int, default=3, help="計測の繰り返し回数 (最小値を採用)")
+    parser.add_argument('--seed', type=int, default=0, help="合成データの乱数シード")
+    parser.add_argument('--output', default=None, help="結果を書き出すJSONファイル")
+    parser.add_argument('--compare', default=None, help="比較対象の過去のJSONファイル")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="許容する速度低下の割合 (デフォルト: 0.2)")
+    args = parser.parse_args(argv)
+    if any(not 1 <= day_count <= 366 for day_count in args.days):
+        parser.error("日数は1〜366で指定してください。")
+
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cases': [],
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for employee_count in args.employees:
+            for day_count in args.days:
+                case = run_case(employee_count, day_count, args.weights, args.early, args.late, args.solver, args.repeat, args.seed, work_dir)
+                results['cases'].append(case)
+                phases = '  '.join(f"{phase} {timing['wall']:.4f}s/{timing['peak_bytes'] / 1024 / 1024:.1f}MiB" for phase, timing in case['phases'].items())
+                print(f"{employee_count}人 x {day_count}日  {phases}")
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"速度低下: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['tkinter', 'pandas', 'numpy', 'pyarrow', 'concurrent.futures.process']
+CHECK_MODULES = f"""
+import json, sys
+import shift_scheduler
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules and type(sys.modules[name]).__name__ != '_LazyModule']
+print(json.dumps(loaded))
+"""
+
+def import_time_us(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\S+)$', line)
+        if match and match.group(2) == module:
+            return int(match.group(1))
+    raise RuntimeError(f"{module} のインポート時間を取得できませんでした")
+
+def loaded_heavy_modules():
+    result = subprocess.run([sys.executable, '-c', CHECK_MODULES], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="shift_schedulerのインポート時間を計測し、起動時間の予算を超えていないか確認します。")
+    parser.add_argument('--budget-ms', type=float, default=100.0, help="許容するインポート時間 (ミリ秒, デフォルト: 100)")
+    parser.add_argument('--repeat', type=int, default=5, help="計測の繰り返し回数 (最小値を採用)")
+    args = parser.parse_args(argv)
+
+    import_ms = min(import_time_us('shift_scheduler') for _ in range(args.repeat)) / 1000
+    loaded = loaded_heavy_modules()
+    print(f"shift_scheduler のインポート時間: {import_ms:.1f}ms (予算 {args.budget_ms:.0f}ms)")
+    if loaded:
+        print(f"インポート時に読み込まれた重いモジュール: {', '.join(loaded)}")
+    return 1 if import_ms > args.budget_ms or loaded else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
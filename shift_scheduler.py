@@ -1,167 +1,1533 @@
-import tkinter as tk
-from tkinter import filedialog
-from tkinter import messagebox
-from tkinter import ttk
-import pandas as pd
+import codecs
+import csv
+import datetime
+import glob
+import hashlib
+import heapq
+import importlib.util
+import io
+import json
 import os
+import pickle
 import random
+import re
+import sys
+import time
+import unicodedata
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+def lazy_import(name):
+    # 属性に初めてアクセスした時点で読み込むため、GUIや短いスクリプトの起動が速くなる
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+SHIFT_LABELS = ['休み', '早番', '遅番', '終日可能']
+REST = 0
+REST_LABEL, ANY_SHIFT_LABEL = SHIFT_LABELS[0], SHIFT_LABELS[-1]
+CSV_ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
+SOLVERS = ('random', 'flow', 'flow-any', 'fair')
+FLOW_SOLVERS = ('flow', 'flow-any')
+DAY_COLUMN_PATTERN = re.compile(r'^希望日 \[(?P<label>[^\]]+)\]$|^(?P<bare>\d{1,2}日)$')
+DAY_LABEL_PATTERN = re.compile(r'^(?:(?:(?P<year>\d{4})[/年-])?(?P<month>\d{1,2})[/月-])?(?P<day>\d{1,2})日?$')
+DAY_CHUNK_SIZE = 31
+PREFERENCE_VIOLATION_COST = 1
+SCHEDULE_CACHE_VERSION = 7
+SHORTAGE_LABEL = '{}人不足'
+TOTAL_COLUMN = '合計'
+DEFAULT_SHIFT_HOURS = 8
+SAVE_CHUNK_ROWS = 50000
+CANCEL_POLL_SECONDS = 0.1
+ENCODING_SAMPLE_BYTES = 64 * 1024
+TIMESTAMP_FORMAT = '%Y/%m/%d %H:%M:%S'
+ISSUE_DISPLAY_LIMIT = 5
+SCHEDULE_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather', '.xlsx': 'xlsx'}
+LIMIT_PERIODS = ('all', 'month', 'week')
+LIMIT_COLUMNS = {'最大勤務日数': 'max_shifts', '最小勤務日数': 'min_shifts', '最大連続勤務日数': 'max_consecutive_days'}
+SUMMARY_COLUMNS = ['店舗', '不足日数', '不足人数', '不足日', '乱数シード', 'キャッシュ', '処理時間(秒)', '警告', 'エラー']
+HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sheets (
+    sheet_id INTEGER PRIMARY KEY,
+    store TEXT NOT NULL,
+    first_date TEXT NOT NULL,
+    last_date TEXT NOT NULL,
+    source TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    imported_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS preferences (
+    sheet_id INTEGER NOT NULL REFERENCES sheets,
+    employee TEXT NOT NULL,
+    date TEXT NOT NULL,
+    preference TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    schedule_id INTEGER PRIMARY KEY,
+    sheet_id INTEGER NOT NULL REFERENCES sheets,
+    store TEXT NOT NULL,
+    first_date TEXT NOT NULL,
+    last_date TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    seed INTEGER,
+    parameters TEXT NOT NULL,
+    shortage_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    schedule_id INTEGER NOT NULL REFERENCES schedules,
+    employee TEXT NOT NULL,
+    date TEXT NOT NULL,
+    shift TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shortages (
+    schedule_id INTEGER NOT NULL REFERENCES schedules,
+    date TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sheets_store_digest ON sheets (store, digest);
+CREATE INDEX IF NOT EXISTS schedules_store_dates ON schedules (store, first_date, last_date);
+CREATE INDEX IF NOT EXISTS preferences_employee_date ON preferences (employee, date);
+CREATE INDEX IF NOT EXISTS assignments_employee_date ON assignments (employee, date);
+CREATE VIEW IF NOT EXISTS latest_assignments AS
+    SELECT schedules.store, assignments.* FROM assignments JOIN schedules USING (schedule_id)
+    WHERE schedule_id = (SELECT MAX(newer.schedule_id) FROM schedules AS newer
+                         WHERE newer.store = schedules.store AND assignments.date BETWEEN newer.first_date AND newer.last_date);
+'''
+HISTORY_VERSION = 2
+PHASE_LABELS = {'cache': 'キャッシュ', 'load': '読み込み', 'prepare': '準備', 'assign': '割り当て', 'build': '表の作成', 'save': '保存'}
+
+# label: シフト名, demand: 1日の必要人数, fillable: このシフトに入れる希望 (優先する順), hours: 勤務時間
+ShiftType = namedtuple('ShiftType', ['label', 'demand', 'fillable', 'hours'], defaults=(DEFAULT_SHIFT_HOURS,))
+
+# row, column: ファイル上の行番号と列番号 (見出しが1行目、1列目から数える)。位置がない場合は None
+PreferenceIssue = namedtuple('PreferenceIssue', ['row', 'column', 'message'])
+
+class ScheduleCancelled(Exception):
+    pass
+
+def default_shift_types(early_shift_count=2, late_shift_count=2):
+    return [
+        ShiftType('早番', early_shift_count, ('早番', ANY_SHIFT_LABEL)),
+        ShiftType('遅番', late_shift_count, ('遅番', ANY_SHIFT_LABEL)),
+    ]
+
+def load_shift_types(file_path):
+    # シフト, 必要人数, 入れる希望 (, 時間) の列を持つCSVを、開始時刻の早い順に並べておく。
+    # 入れる希望を空欄にした場合は、そのシフト名と「終日可能」の希望で埋める
+    try:
+        table = pd.read_csv(file_path, encoding='utf-8-sig', dtype={'シフト': str, '入れる希望': str})
+        if '時間' not in table.columns:
+            table['時間'] = DEFAULT_SHIFT_HOURS
+        shift_types = []
+        for label, demand, fillable, hours in table[['シフト', '必要人数', '入れる希望', '時間']].itertuples(index=False, name=None):
+            label = label.strip()
+            fillable = tuple(fillable.split()) if isinstance(fillable, str) and fillable.strip() else (label, ANY_SHIFT_LABEL)
+            shift_types.append(ShiftType(label, int(demand), fillable, float(hours) if pd.notna(hours) else DEFAULT_SHIFT_HOURS))
+    except Exception as e:
+        raise Exception(f"シフト定義ファイルの読み込みに失敗しました: {e}")
+    validate_shift_types(shift_types)
+    return shift_types
+
+def validate_shift_types(shift_types):
+    labels = [shift_type.label for shift_type in shift_types]
+    if not labels or len(set(labels)) != len(labels) or any(label in (REST_LABEL, '') or label.endswith('不足') for label in labels):
+        raise ValueError("シフト名が空か重複しています。")
+    if any(shift_type.demand < 0 for shift_type in shift_types):
+        raise ValueError(f"{'または'.join(labels)}の人数に無効な値が設定されています。")
+    if any(not shift_type.hours > 0 for shift_type in shift_types):
+        raise ValueError("シフトの時間は0より大きい値を指定してください。")
+
+def preference_labels(shift_types):
+    labels = [REST_LABEL] + [shift_type.label for shift_type in shift_types]
+    for shift_type in shift_types:
+        labels.extend(label for label in shift_type.fillable if label not in labels)
+    return labels
+
+def output_labels(shift_types, max_shortage=0):
+    shortage_labels = [SHORTAGE_LABEL.format(count) for count in range(1, max_shortage + 1)]
+    return [REST_LABEL] + [shift_type.label for shift_type in shift_types] + shortage_labels + ['']
+
+def load_demand_table(file_path):
+    # 日付, <シフト名>... の列を持つCSVを {日付: {シフト名: 人数}} にする。
+    # 日付は「1日」「11月1日」「2024/4/6」のように書き、空欄のシフトはシフト定義の人数を使う
+    try:
+        table = pd.read_csv(file_path, encoding='utf-8-sig', dtype={'日付': str})
+        if '日付' not in table.columns:
+            raise ValueError("「日付」の列がありません。")
+        columns = [column for column in table.columns if column != '日付']
+        demand_table = {}
+        for row in table[['日付'] + columns].itertuples(index=False, name=None):
+            demand_table[str(row[0]).strip()] = {column: int(value) for column, value in zip(columns, row[1:]) if pd.notna(value)}
+    except Exception as e:
+        raise Exception(f"必要人数表の読み込みに失敗しました: {e}")
+    return demand_table
+
+def load_target_hours(file_path):
+    # 名前, 目標時間 の列を持つCSVを {名前: 時間} にする。空欄の人は目標なしとして扱う
+    try:
+        table = pd.read_csv(file_path, encoding='utf-8-sig', dtype={'名前': str})
+        if '名前' not in table.columns or '目標時間' not in table.columns:
+            raise ValueError("「名前」と「目標時間」の列が必要です。")
+        target_hours = {name.strip(): float(hours) for name, hours in table[['名前', '目標時間']].itertuples(index=False, name=None) if pd.notna(hours)}
+    except Exception as e:
+        raise Exception(f"目標時間ファイルの読み込みに失敗しました: {e}")
+    if any(hours <= 0 for hours in target_hours.values()):
+        raise ValueError("目標時間は0より大きい値を指定してください。")
+    return target_hours
+
+def demand_day_indices(demand_table, days, dates):
+    # 必要人数表の日付をシフト表の列番号に対応付ける。シフト表にない日付は、書き間違いに気付けるよう例外にする
+    by_label = {label: i for i, label in enumerate(days)}
+    by_date = {}
+    dated = all(date is not None for date in dates)
+    if dated:
+        for i, date in enumerate(dates):
+            by_date[(date.year, date.month, date.day)] = i
+            by_date.setdefault((None, date.month, date.day), i)
+            by_date.setdefault((None, None, date.day), i)
+    else:
+        for i, label in enumerate(days):
+            by_date[(None, None, int(DAY_LABEL_PATTERN.match(label).group('day')))] = i
+    indices = {}
+    unmatched = []
+    for key in demand_table:
+        if key in by_label:
+            indices[key] = by_label[key]
+            continue
+        match = DAY_LABEL_PATTERN.match(key)
+        if match is None:
+            raise ValueError(f"必要人数表の日付が正しくありません: {key}")
+        year, month, day = (int(match.group(name)) if match.group(name) else None for name in ('year', 'month', 'day'))
+        if month is not None and not dated:
+            raise ValueError(f"必要人数表の日付に月がありますが、希望日の列に年月がありません。--start-monthで年月を指定してください: {key}")
+        i = by_date.get((year, month, day))
+        if i is None:
+            unmatched.append(key)
+        else:
+            indices[key] = i
+    if unmatched:
+        raise ValueError(f"必要人数表の日付がシフト表の期間にありません: {'、'.join(unmatched)}")
+    return indices
+
+def day_keys(days, dates):
+    # 店舗や実行をまたいで日を突き合わせるための文字列。日付が分かる場合はISO形式にする
+    return [date.isoformat() if date is not None else day for day, date in zip(days, dates)]
+
+def sniff_encoding(file_path, sample_size=ENCODING_SAMPLE_BYTES):
+    # 先頭のバイト列だけで判定する。BOMがあればutf-8-sig、utf-8として読めなければcp932とみなす
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # 読み込んだ範囲の末尾で文字が途切れただけの場合はutf-8のまま
+        if e.reason != 'unexpected end of data':
+            return 'cp932'
+    return 'utf-8'
+
+def format_issue(issue):
+    position = ''.join(f'{value}{unit}' for value, unit in ((issue.row, '行目'), (issue.column, '列目')) if value is not None)
+    return f"{position}: {issue.message}" if position else issue.message
+
+def summarize_issues(issues, limit=ISSUE_DISPLAY_LIMIT):
+    lines = [format_issue(issue) for issue in issues[:limit]]
+    if len(issues) > limit:
+        lines.append(f"ほか{len(issues) - limit}件")
+    return lines
+
+def normalize_labels(column):
+    # 前後の空白や全角・半角の違いを吸収する。行ごとではなくカテゴリ名だけを変換する
+    categories = [str(label) for label in column.cat.categories]
+    normalized = [unicodedata.normalize('NFKC', label).strip() for label in categories]
+    if normalized == categories:
+        return column
+    labels = list(dict.fromkeys(label for label in normalized if label))
+    remap = np.array([labels.index(label) if label else -1 for label in normalized] + [-1])
+    return pd.Series(pd.Categorical.from_codes(remap[column.cat.codes.to_numpy()], labels), index=column.index, name=column.name)
+
+def discover_day_columns(columns, start_date=None, skipped=None):
+    # 「希望日 [1日]」「希望日 [11月1日]」「希望日 [2024/1/5]」などの列を日付に対応付ける。
+    # 年や月が省略された列は start_date と列の並びから補い、月や年の折り返しも考慮する。
+    # 11月の表の「31日」のように存在しない日付の列は使わず、skipped に (列名, 日付) を加える
+    day_columns = []
+    year = start_date.year if start_date is not None else datetime.date.today().year
+    month = start_date.month if start_date is not None else None
+    previous = None
+    for column in columns:
+        column_match = DAY_COLUMN_PATTERN.match(str(column))
+        if column_match is None:
+            continue
+        label = column_match.group('label') or column_match.group('bare')
+        label_match = DAY_LABEL_PATTERN.match(label.strip())
+        if label_match is None:
+            continue
+        day = int(label_match.group('day'))
+        if label_match.group('year'):
+            year = int(label_match.group('year'))
+        if label_match.group('month'):
+            if previous is not None and not label_match.group('year') and int(label_match.group('month')) < previous[0]:
+                year += 1
+            month = int(label_match.group('month'))
+        elif month is not None and previous is not None and day < previous[1]:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        date = None
+        if month is not None:
+            try:
+                date = datetime.date(year, month, day)
+            except ValueError:
+                if skipped is not None:
+                    skipped.append((column, f'{year}年{month}月{day}日'))
+                continue
+        previous = (month, day)
+        day_columns.append((column, label.strip(), date))
+    if all(date is not None for _, _, date in day_columns):
+        return sorted(day_columns, key=lambda day_column: day_column[2])
+    return sorted(day_columns, key=lambda day_column: int(DAY_LABEL_PATTERN.match(day_column[1]).group('day')))
+
+def min_cost_flow(node_count, edges, source, sink):
+    graph = [[] for _ in range(node_count)]
+    edge_refs = []
+    for u, v, capacity, cost in edges:
+        edge_refs.append((u, len(graph[u])))
+        graph[u].append([v, capacity, cost, len(graph[v])])
+        graph[v].append([u, 0, -cost, len(graph[u]) - 1])
+    while True:
+        distance = [float('inf')] * node_count
+        previous = [None] * node_count
+        distance[source] = 0
+        updated = True
+        while updated:
+            updated = False
+            for u in range(node_count):
+                if distance[u] == float('inf'):
+                    continue
+                for i, (v, capacity, cost, _) in enumerate(graph[u]):
+                    if capacity > 0 and distance[u] + cost < distance[v]:
+                        distance[v] = distance[u] + cost
+                        previous[v] = (u, i)
+                        updated = True
+        if distance[sink] == float('inf'):
+            break
+        path = []
+        v = sink
+        while v != source:
+            u, i = previous[v]
+            path.append((u, i))
+            v = u
+        flow = min(graph[u][i][1] for u, i in path)
+        for u, i in path:
+            edge = graph[u][i]
+            edge[1] -= flow
+            graph[edge[0]][edge[3]][1] += flow
+    return [capacity - graph[u][i][1] for (u, i), (_, _, capacity, _) in zip(edge_refs, edges)]
+
+class SchedulerMetrics:
+    def __init__(self, profile=False):
+        self.phases = {}
+        self.days = []
+        self.day_seconds = {}
+        self.profiler = None
+        if profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    @contextmanager
+    def phase(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if self.profiler is not None:
+            self.profiler.enable()
+        try:
+            yield
+        finally:
+            if self.profiler is not None:
+                self.profiler.disable()
+            timing = self.phases.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            timing['wall'] += time.perf_counter() - wall_start
+            timing['cpu'] += time.process_time() - cpu_start
+
+    def record_day(self, day_index, seconds):
+        self.day_seconds[day_index] = seconds
+
+    def profile_stats(self, limit=30):
+        if self.profiler is None:
+            return None
+        import pstats
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def dump_profile(self, file_path):
+        self.profiler.dump_stats(file_path)
+
+    def to_dict(self):
+        return {
+            'phases': self.phases,
+            'days': {self.days[i] if i < len(self.days) else str(i): seconds for i, seconds in sorted(self.day_seconds.items())},
+            'profile': self.profile_stats(),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def summary(self):
+        return ' / '.join(f"{PHASE_LABELS.get(name, name)} {timing['wall']:.2f}秒" for name, timing in self.phases.items())
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest
+
+class ScheduleCache:
+    def __init__(self, max_entries=32, cache_dir=None, max_disk_bytes=256 * 1024 * 1024):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, file_path, *parameters):
+        digest = file_digest(file_path)
+        digest.update(repr((SCHEDULE_CACHE_VERSION,) + parameters).encode())
+        return digest.hexdigest()
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.cache_dir is not None:
+            try:
+                with open(self.disk_path(key), 'rb') as f:
+                    value = pickle.load(f)
+                os.utime(self.disk_path(key))
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+            else:
+                self.remember(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.remember(key, value)
+        if self.cache_dir is not None:
+            temp_path = f'{self.disk_path(key)}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.disk_path(key))
+            self.evict_disk()
+
+    def remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def evict_disk(self):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+class ScheduleHistory:
+    # 読み込んだ希望シフトと作成したシフト表をSQLiteに残す。休み以外のマスを1行ずつ持ち、
+    # (名前, 日付) と (店舗, 期間) の索引で、期間中の勤務回数などをCSVを読み直さずに集計できる。
+    # 日付はすべてYYYY-MM-DDで持ち、シフト表ごとに最初と最後の日付を記録する
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        # バッチ実行では複数のプロセスが同じファイルに書き込むので、WALにしてロックを待つ
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != HISTORY_VERSION and self.connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'schedules'").fetchone()[0]:
+            self.connection.close()
+            raise Exception(f"履歴ファイルの形式が古いため記録できません。別のファイルを指定してください: {path}")
+        self.connection.executescript(HISTORY_SCHEMA)
+        self.connection.execute(f'PRAGMA user_version = {HISTORY_VERSION}')
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def check_dates(dates):
+        # 「1日」のように年月のない日付では期間をまたいだ集計ができないので、記録しない
+        if not dates or any(date is None for date in dates):
+            raise Exception("履歴に記録するには希望日の年月が必要です。--start-monthで年月を指定してください。")
+
+    def record(self, store, file_path, scheduler, shift_types, parameters):
+        last_run = scheduler.last_run
+        days, dates = last_run['days'], last_run['dates']
+        self.check_dates(dates)
+        keys = np.array(day_keys(days, dates), dtype=object)
+        first_date, last_date = min(dates).isoformat(), max(dates).isoformat()
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        digest = file_digest(file_path).hexdigest()
+        with self.connection:
+            # 同じ店舗の同じファイルは、希望シフトを一度だけ保存する
+            row = self.connection.execute('SELECT sheet_id FROM sheets WHERE store = ? AND digest = ?', (store, digest)).fetchone()
+            if row is not None:
+                sheet_id = row[0]
+            else:
+                sheet_id = self.connection.execute('INSERT INTO sheets (store, first_date, last_date, source, digest, imported_at) VALUES (?, ?, ?, ?, ?, ?)',
+                                                   (store, first_date, last_date, os.path.abspath(file_path), digest, now)).lastrowid
+                self.insert_cells('preferences', sheet_id, last_run['names'], keys, last_run['preference_matrix'], preference_labels(shift_types))
+            parameters = json.dumps(parameters, ensure_ascii=False, default=str)
+            # 同じシフト表を続けて記録した場合 (キャッシュから返した場合など) は、行を増やさない
+            latest = self.connection.execute('SELECT schedule_id, sheet_id, seed, parameters FROM schedules WHERE store = ? ORDER BY schedule_id DESC LIMIT 1', (store,)).fetchone()
+            if latest is not None and latest[1:] == (sheet_id, scheduler.seed, parameters):
+                return latest[0]
+            schedule_id = self.connection.execute(
+                'INSERT INTO schedules (sheet_id, store, first_date, last_date, created_at, seed, parameters, shortage_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (sheet_id, store, first_date, last_date, now, scheduler.seed, parameters, int(scheduler.shortage_counts.sum()))).lastrowid
+            self.insert_cells('assignments', schedule_id, scheduler.shift_schedule.index[:-1], keys, last_run['schedule_matrix'], output_labels(shift_types))
+            shortage = np.flatnonzero(scheduler.shortage_counts)
+            self.connection.executemany('INSERT INTO shortages VALUES (?, ?, ?)', zip([schedule_id] * len(shortage), keys[shortage].tolist(), scheduler.shortage_counts[shortage].tolist()))
+        return schedule_id
+
+    def insert_cells(self, table, parent_id, names, keys, matrix, labels):
+        rows, columns = np.nonzero(matrix != REST)
+        names = np.asarray(names, dtype=object)
+        labels = np.array(labels, dtype=object)
+        self.connection.executemany(f'INSERT INTO {table} VALUES (?, ?, ?, ?)',
+                                    zip([parent_id] * len(rows), names[rows].tolist(), keys[columns].tolist(), labels[matrix[rows, columns]].tolist()))
+
+    def shift_counts(self, employee, start=None, end=None):
+        # 店舗と日付ごとに、その日を含むシフト表のうち最後に作ったものだけを数える
+        query = 'SELECT shift, COUNT(*) FROM latest_assignments WHERE employee = ?'
+        arguments = [employee]
+        if start is not None:
+            query += ' AND date >= ?'
+            arguments.append(str(start))
+        if end is not None:
+            query += ' AND date <= ?'
+            arguments.append(str(end))
+        return dict(self.connection.execute(query + ' GROUP BY shift', arguments).fetchall())
+
+class WorkloadLimits:
+    def __init__(self, max_shifts=None, min_shifts=None, max_consecutive_days=None, no_late_to_early=False, period='all', overrides=None):
+        if period not in LIMIT_PERIODS:
+            raise ValueError(f"不明な集計期間です: {period}")
+        self.max_shifts = max_shifts
+        self.min_shifts = min_shifts
+        self.max_consecutive_days = max_consecutive_days
+        self.no_late_to_early = no_late_to_early
+        self.period = period
+        self.overrides = overrides or {}
+
+    def __repr__(self):
+        # キャッシュのキーに使うため、設定がすべて含まれるようにする
+        overrides = sorted((name, sorted(values.items())) for name, values in self.overrides.items())
+        return f'WorkloadLimits({self.max_shifts!r}, {self.min_shifts!r}, {self.max_consecutive_days!r}, {self.no_late_to_early!r}, {self.period!r}, {overrides!r})'
+
+    @staticmethod
+    def load_overrides(file_path):
+        # 名前ごとの上限・下限を書いたCSVを読む。空欄の項目は全体の設定を使う
+        try:
+            table = pd.read_csv(file_path, encoding='utf-8-sig')
+        except Exception as e:
+            raise Exception(f"勤務条件ファイルの読み込みに失敗しました: {e}")
+        if '名前' not in table.columns:
+            raise Exception("勤務条件ファイルに「名前」の列がありません。")
+        columns = [column for column in LIMIT_COLUMNS if column in table.columns]
+        overrides = {}
+        for row in table[['名前'] + columns].itertuples(index=False, name=None):
+            values = {LIMIT_COLUMNS[column]: int(value) for column, value in zip(columns, row[1:]) if pd.notna(value)}
+            overrides.setdefault(row[0], {}).update(values)
+        return overrides
+
+    def per_employee(self, names):
+        names = pd.Series(names)
+        arrays = []
+        for field, default in (('max_shifts', self.max_shifts), ('min_shifts', self.min_shifts), ('max_consecutive_days', self.max_consecutive_days)):
+            if default is None:
+                default = 0 if field == 'min_shifts' else np.iinfo(np.int32).max
+            values = names.map({name: values[field] for name, values in self.overrides.items() if field in values})
+            arrays.append(values.fillna(default).to_numpy(dtype=np.int32))
+        return arrays
+
+    def period_key(self, date):
+        if self.period == 'month':
+            return None if date is None else (date.year, date.month)
+        if self.period == 'week':
+            return date.isocalendar()[:2]
+        return None
+
+class WorkloadTracker:
+    # 勤務日数・連続勤務日数・前日のシフトを従業員ごとの配列で持ち、1日ごとに更新する。
+    # 途中までのシフト表を見直すことはないので、処理量は従業員数×日数に比例する
+    def __init__(self, limits, names, dates, shift_count):
+        if limits.period in ('month', 'week') and any(date is None for date in dates):
+            period_label = '月' if limits.period == 'month' else '週'
+            raise Exception(f"{period_label}ごとの勤務日数を数えるには、希望日の列の年月が必要です。--start-monthで年月を指定してください。")
+        self.limits = limits
+        self.max_shifts, self.min_shifts, self.max_consecutive_days = limits.per_employee(names)
+        self.has_minimum = bool((self.min_shifts > 0).any())
+        self.worked = np.zeros(len(names), dtype=np.int32)
+        self.consecutive = np.zeros(len(names), dtype=np.int32)
+        self.previous_shift = np.full(len(names), REST, dtype=np.uint8)
+        self.previous_date = None
+        self.shift_count = shift_count
+
+    def start_day(self, date):
+        if self.previous_date is not None and date is not None:
+            if (date - self.previous_date).days > 1:
+                self.consecutive[:] = 0
+                self.previous_shift[:] = REST
+            if self.limits.period_key(date) != self.limits.period_key(self.previous_date):
+                self.worked[:] = 0
+        self.previous_date = date
+        self.eligible = (self.worked < self.max_shifts) & (self.consecutive < self.max_consecutive_days)
+        # シフトは開始の早い順に並んでいるので、前日より早いシフトには入れない
+        self.blocked = [self.previous_shift > code for code in range(1, self.shift_count + 1)] if self.limits.no_late_to_early else None
+        self.priority = self.worked < self.min_shifts if self.has_minimum else None
+
+    def record(self, assigned):
+        self.previous_shift[:] = REST
+        for code, employees in enumerate(assigned, 1):
+            self.previous_shift[employees] = code
+        working = self.previous_shift != REST
+        self.worked += working
+        self.consecutive = np.where(working, self.consecutive + 1, 0).astype(np.int32)
+
+class FairnessTracker:
+    # 従業員ごとの勤務日数と勤務時間を配列で持ち、1日ごとに足していく。load は目標時間に対する
+    # 勤務時間の割合で、目標のない人は目標のある人の平均を目標とみなす (誰にも目標がなければ勤務時間のまま)
+    def __init__(self, names, shift_types, target_hours=None):
+        self.hours_per_shift = np.array([shift_type.hours for shift_type in shift_types], dtype=np.float64)
+        self.shifts = np.zeros(len(names), dtype=np.int32)
+        self.hours = np.zeros(len(names), dtype=np.float64)
+        targets = pd.Series(names, dtype=object).map(target_hours or {}).to_numpy(dtype=np.float64)
+        has_target = ~np.isnan(targets)
+        self.has_targets = bool(has_target.any())
+        self.targets = np.where(has_target, targets, targets[has_target].mean() if self.has_targets else 1.0)
+        self.load = np.zeros(len(names), dtype=np.float64)
+
+    def record(self, assigned):
+        for code, employees in enumerate(assigned):
+            employees = np.array(employees, dtype=np.intp)
+            self.shifts[employees] += 1
+            self.hours[employees] += self.hours_per_shift[code]
+            self.load[employees] = self.hours[employees] / self.targets[employees]
+
+    def totals(self, employee_rows, employee_count):
+        # 名前ごとの「12日 96時間」と、不足の行に入れる差 (勤務日数・勤務時間、目標があれば達成率) を返す
+        shifts = np.bincount(employee_rows, weights=self.shifts, minlength=employee_count).astype(np.int64)
+        hours = np.bincount(employee_rows, weights=self.hours, minlength=employee_count)
+        targets = np.zeros(employee_count)
+        targets[employee_rows] = self.targets
+        if self.has_targets:
+            cells = [f'{count}日 {worked:g}/{target:g}時間' for count, worked, target in zip(shifts.tolist(), hours.tolist(), targets.tolist())]
+        else:
+            cells = [f'{count}日 {worked:g}時間' for count, worked in zip(shifts.tolist(), hours.tolist())]
+        if not employee_count:
+            return cells, ''
+        spread = f'差 {shifts.max() - shifts.min()}日 {hours.max() - hours.min():g}時間'
+        if self.has_targets:
+            ratios = hours / targets * 100
+            spread += f' 達成率 {ratios.min():.0f}〜{ratios.max():.0f}%'
+        return cells, spread
 
 class ShiftScheduler:
-    def __init__(self):
+    def __init__(self, cache=None, profile=False, start_date=None, limits=None, history=None, target_hours=None):
+        self.cache = cache
+        self.history = history
+        self.start_date = start_date
+        self.limits = limits
+        self.target_hours = target_hours
+        self.profile = profile
+        self.metrics = SchedulerMetrics(profile)
         self.shift_schedule = None
+        self.shortage_counts = None
+        self.seed = None
+        self.dates = None
+        self.last_run = None
+        self.issues = []
+        self.rng = random.Random()
+
+    def options(self):
+        return {'start_date': self.start_date, 'limits': self.limits, 'target_hours': self.target_hours}
 
-    def load_preferences(self, file_path):
+    def reset_metrics(self):
+        self.metrics = SchedulerMetrics(self.profile)
+
+    def load_preferences(self, file_path, shift_types=None, with_email=False):
+        # 1回の読み込みで、見出しの確認・希望の正規化・再回答の除去・不明な希望の検出まで行う。
+        # 続けられない見出しの問題は例外にし、それ以外は行と列の位置を付けて self.issues に残す
+        self.issues = []
         try:
-            preferences = pd.read_csv(file_path)
-            return preferences
+            with self.metrics.phase('load'):
+                encoding = sniff_encoding(file_path)
+                with open(file_path, encoding=encoding, newline='') as f:
+                    header = next(csv.reader(f), [])
+                positions, day_columns = self.check_header(header)
+                skipped = []
+                discover_day_columns(day_columns, self.start_date, skipped)
+                for column, date_label in skipped:
+                    self.issues.append(PreferenceIssue(1, positions[column], f"「{column}」は{date_label}となり存在しない日付のため、この列は使いません"))
+                    day_columns.remove(column)
+                if not day_columns:
+                    raise ValueError("1行目: 希望日の列がありません。")
+                identity_columns = ('タイムスタンプ', '名前', 'メールアドレス') if with_email else ('タイムスタンプ', '名前')
+                columns = [col for col in identity_columns if col in positions] + day_columns
+                # 希望の種類はシフト定義で変わるので、ここではカテゴリ型にするだけにする
+                dtype = {'タイムスタンプ': str, '名前': str, 'メールアドレス': str, **{col: 'category' for col in day_columns}}
+                preferences = pd.read_csv(file_path, encoding=encoding, usecols=columns, dtype=dtype, engine=CSV_ENGINE)
+                preferences = self.latest_submissions(preferences)
+                for column in day_columns:
+                    preferences[column] = normalize_labels(preferences[column])
+                if shift_types is not None:
+                    self.check_labels(preferences, day_columns, positions, preference_labels(shift_types))
+            return preferences.reset_index(drop=True)
         except Exception as e:
             raise Exception(f"ファイルの読み込みに失敗しました: {e}")
 
-    def assign_shifts_for_day(self, preferences, day, early_shift_count, late_shift_count):
-        early_shift_candidates = preferences[preferences[day] == '早番']['名前'].tolist()
-        late_shift_candidates = preferences[preferences[day] == '遅番']['名前'].tolist()
-        all_day_candidates = preferences[preferences[day] == '終日可能']['名前'].tolist()
-        assigned_early_shift = random.sample(early_shift_candidates, min(early_shift_count, len(early_shift_candidates)))
-        assigned_late_shift = random.sample(late_shift_candidates, min(late_shift_count, len(late_shift_candidates)))
-        while len(assigned_early_shift) < early_shift_count:
-            if all_day_candidates:
-                candidate = random.choice(all_day_candidates)
-                assigned_early_shift.append(candidate)
-                all_day_candidates.remove(candidate)
-            else:
-                break
-        while len(assigned_late_shift) < late_shift_count:
-            if all_day_candidates:
-                candidate = random.choice(all_day_candidates)
-                assigned_late_shift.append(candidate)
-                all_day_candidates.remove(candidate)
-            else:
-                break
-        shift_assignments = {
-            '早番': assigned_early_shift,
-            '遅番': assigned_late_shift,
-            '休み': [name for name in preferences['名前'] if name not in assigned_early_shift + assigned_late_shift]
+    def check_header(self, header):
+        positions = {}
+        for position, column in enumerate(header, 1):
+            if column in positions:
+                if column == '名前' or DAY_COLUMN_PATTERN.match(column):
+                    self.issues.append(PreferenceIssue(1, position, f"「{column}」の列が{positions[column]}列目と重複しているため、この列は使いません"))
+                continue
+            positions[column] = position
+        if '名前' not in positions:
+            raise ValueError("1行目: 「名前」の列がありません。")
+        day_columns = []
+        for column, position in positions.items():
+            column_match = DAY_COLUMN_PATTERN.match(column)
+            if column_match is None:
+                continue
+            if DAY_LABEL_PATTERN.match((column_match.group('label') or column_match.group('bare')).strip()) is None:
+                self.issues.append(PreferenceIssue(1, position, f"「{column}」から日付を読み取れないため、この列は使いません"))
+                continue
+            day_columns.append(column)
+        if not day_columns:
+            raise ValueError("1行目: 希望日の列がありません。")
+        return positions, day_columns
+
+    def latest_submissions(self, preferences):
+        # Googleフォームで回答し直した人は、タイムスタンプが最も新しい回答だけを使う。
+        # 行番号を報告できるよう、ここでは読み込んだときの行番号 (0始まり) を索引のまま残す
+        names = preferences['名前'].str.strip()
+        for row in preferences.index[names.isna() | (names == '')]:
+            self.issues.append(PreferenceIssue(row + 2, None, "名前が空欄のため、この行は使いません"))
+        preferences = preferences.assign(名前=names)[names.notna() & (names != '')]
+        order = preferences.index
+        if 'タイムスタンプ' in preferences.columns:
+            # Googleフォームの書式をまず試し、読めなかった行だけ書式を推測する
+            submitted = pd.to_datetime(preferences['タイムスタンプ'], errors='coerce', format=TIMESTAMP_FORMAT)
+            retry = submitted.isna() & preferences['タイムスタンプ'].notna()
+            if retry.any():
+                submitted[retry] = pd.to_datetime(preferences['タイムスタンプ'][retry], errors='coerce', format='mixed')
+            for row in preferences.index[submitted.isna() & preferences['タイムスタンプ'].notna()]:
+                self.issues.append(PreferenceIssue(row + 2, None, "タイムスタンプを読み取れないため、最も古い回答として扱います"))
+            order = submitted.sort_values(kind='stable', na_position='first').index
+            preferences = preferences.drop(columns='タイムスタンプ')
+        ordered_names = preferences.loc[order, '名前']
+        stale = ordered_names.duplicated(keep='last')
+        if stale.any():
+            latest_rows = dict(zip(ordered_names[~stale], ordered_names.index[~stale]))
+            for row, name in ordered_names[stale].sort_index().items():
+                self.issues.append(PreferenceIssue(row + 2, None, f"{name}さんの古い回答のため使いません ({latest_rows[name] + 2}行目の回答を使います)"))
+            preferences = preferences.drop(index=ordered_names.index[stale])
+        return preferences
+
+    def check_labels(self, preferences, day_columns, positions, labels):
+        known = set(labels)
+        for column in day_columns:
+            unknown = [label for label in preferences[column].cat.categories if label not in known]
+            if not unknown:
+                continue
+            cells = preferences[column][preferences[column].isin(unknown)]
+            for row, label in cells.items():
+                self.issues.append(PreferenceIssue(row + 2, positions[column], f"不明な希望「{label}」は休みとして扱います"))
+
+    def encode_preferences(self, preferences, columns, labels=SHIFT_LABELS):
+        preference_matrix = np.empty((len(preferences), len(columns)), dtype=np.uint8)
+        codes_by_label = {label: code for code, label in enumerate(labels)}
+        for i, column in enumerate(columns):
+            values = preferences[column]
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype('category')
+            # カテゴリごとの番号表を作り、空欄と不明な希望は休みにする
+            lookup = np.array([codes_by_label.get(label, REST) for label in values.cat.categories] + [REST], dtype=np.uint8)
+            preference_matrix[:, i] = lookup[values.cat.codes.to_numpy()]
+        return preference_matrix
+
+    def candidates_by_day(self, preference_matrix, code_count):
+        # 日と希望の組を1つのキーにして1回だけ並べ替え、日ごと・希望ごとの候補者をまとめて求める。
+        # シフトの種類が増えても、希望の表をなめる回数は変わらない
+        day_count = preference_matrix.shape[1]
+        keys = preference_matrix.T.astype(np.uint16) + (np.arange(day_count, dtype=np.uint16) * code_count)[:, None]
+        employee_indices = np.argsort(keys, axis=None, kind='stable') % preference_matrix.shape[0]
+        counts = np.bincount(keys.ravel(), minlength=day_count * code_count)
+        groups = np.split(employee_indices, np.cumsum(counts)[:-1])
+        return [groups[day * code_count:(day + 1) * code_count] for day in range(day_count)]
+
+    def pick(self, candidates, count, priority=None):
+        count = max(min(count, len(candidates)), 0)
+        if priority is None:
+            return self.rng.sample(candidates, count)
+        # 最低勤務日数に届いていない人から先に選ぶ
+        urgent = [candidate for candidate in candidates if priority[candidate]]
+        if len(urgent) >= count:
+            return self.rng.sample(urgent, count)
+        others = [candidate for candidate in candidates if not priority[candidate]]
+        chosen = urgent + self.rng.sample(others, count - len(urgent))
+        self.rng.shuffle(chosen)
+        return chosen
+
+    def pick_fair(self, candidates, count, load, priority=None):
+        # これまでの勤務が少ない人から順にヒープで取り出す。同じ値の人どうしはランダムに選ぶ。
+        # ヒープを作るのが候補者数に比例、取り出しが1人あたり log(候補者数) で済む
+        count = max(min(count, len(candidates)), 0)
+        if count == len(candidates):
+            return list(candidates)
+        if priority is None:
+            heap = [(load[candidate], self.rng.random(), candidate) for candidate in candidates]
+        else:
+            heap = [(not priority[candidate], load[candidate], self.rng.random(), candidate) for candidate in candidates]
+        heapq.heapify(heap)
+        return [heapq.heappop(heap)[-1] for _ in range(count)]
+
+    def assign_shifts_for_day(self, candidates, fill_codes, demands, priority=None, blocked=None, load=None):
+        # 各シフトを第1候補の希望の人、第2候補の希望の人…の順に埋める。
+        # 「終日可能」のように複数のシフトに入れる人は、先に選ばれたシフトに入る。
+        # load を渡した場合は、ランダムではなくこれまでの勤務が少ない人から選ぶ
+        assigned = [[] for _ in demands]
+        remaining = {}
+        for rank in range(max(len(codes) for codes in fill_codes)):
+            for shift, codes in enumerate(fill_codes):
+                if rank >= len(codes):
+                    continue
+                code = codes[rank]
+                if code not in remaining:
+                    remaining[code] = candidates[code].tolist()
+                pool = remaining[code]
+                if blocked is not None:
+                    pool = [candidate for candidate in pool if not blocked[shift][candidate]]
+                if load is None:
+                    chosen = self.pick(pool, demands[shift] - len(assigned[shift]), priority)
+                else:
+                    chosen = self.pick_fair(pool, demands[shift] - len(assigned[shift]), load, priority)
+                if chosen:
+                    assigned[shift].extend(chosen)
+                    chosen = set(chosen)
+                    remaining[code] = [candidate for candidate in remaining[code] if candidate not in chosen]
+        return assigned
+
+    def assign_shifts_for_day_optimal(self, candidates, fill_codes, demands, priority=None, blocked=None, any_shift=False):
+        # 希望の種類ごとに人をまとめたグラフなので、従業員数に関係なく頂点数は一定で済む。
+        # 入れる希望のシフトへは費用0で流す。any_shift の場合だけ、希望していないシフトへも
+        # PREFERENCE_VIOLATION_COST で流し、希望を曲げてでも不足を減らす
+        pools = []
+        for code in range(1, len(candidates)):
+            if blocked is None:
+                pools.append((candidates[code], [True] * len(demands), code))
+                continue
+            # 前日のシフトによって入れないシフトがある人は、別のまとまりにする
+            signature = np.zeros(len(candidates[code]), dtype=np.int64)
+            for shift, shift_blocked in enumerate(blocked):
+                signature |= shift_blocked[candidates[code]].astype(np.int64) << shift
+            for key in np.unique(signature).tolist():
+                pools.append((candidates[code][signature == key], [not (key >> shift) & 1 for shift in range(len(demands))], code))
+        source, sink = 0, len(pools) + len(demands) + 1
+        shift_node = len(pools) + 1
+        edges = [(source, pool, len(members), 0) for pool, (members, _, _) in enumerate(pools, 1)]
+        for pool, (_, allowed, code) in enumerate(pools, 1):
+            edges.extend((pool, shift_node + shift, demand, 0 if code in fill_codes[shift] else PREFERENCE_VIOLATION_COST)
+                         for shift, demand in enumerate(demands) if allowed[shift] and (any_shift or code in fill_codes[shift]))
+        edges.extend((shift_node + shift, sink, demand, 0) for shift, demand in enumerate(demands))
+        flows = min_cost_flow(sink + 1, edges, source, sink)
+        assigned = [[] for _ in demands]
+        for pool, (members, _, _) in enumerate(pools, 1):
+            pool_flows = [(v - shift_node, flow) for (u, v, _, _), flow in zip(edges, flows) if u == pool and flow > 0]
+            chosen = self.pick(members.tolist(), sum(flow for _, flow in pool_flows), priority)
+            for shift, flow in pool_flows:
+                assigned[shift].extend(chosen[:flow])
+                chosen = chosen[flow:]
+        return assigned
+
+    def schedule_from_file(self, file_path, shift_types, solver='random', seed=None, attempts=1, workers=None, progress=None, cancel_event=None, demand_table=None):
+        key = None
+        if self.cache is not None:
+            # シードを先に決めておき、表示したシードで作り直したときにキャッシュから返せるようにする
+            if seed is None:
+                seed = random.randrange(2 ** 32)
+            with self.metrics.phase('cache'):
+                key = self.cache.make_key(file_path, shift_types, solver, seed, attempts, self.start_date, self.limits, demand_table, self.target_hours)
+                cached = self.cache.get(key)
+            if cached is not None:
+                self.shift_schedule, self.shortage_counts, self.seed, self.last_run, self.issues = cached
+                self.dates = self.last_run['dates']
+                self.record_history(file_path, shift_types, solver, attempts, demand_table)
+                return True
+        preferences = self.load_preferences(file_path, shift_types)
+        if self.history is not None:
+            self.history.check_dates([date for _, _, date in discover_day_columns(preferences.columns, self.start_date)])
+        if attempts > 1:
+            self.create_best_shift_schedule(preferences, shift_types, attempts, workers=workers, solver=solver, seed=seed, progress=progress, cancel_event=cancel_event, demand_table=demand_table)
+        else:
+            self.create_shift_schedule(preferences, shift_types, progress=progress, cancel_event=cancel_event, solver=solver, seed=seed, demand_table=demand_table)
+        if key is not None:
+            self.cache.put(key, (self.shift_schedule, self.shortage_counts, self.seed, self.last_run, self.issues))
+        self.record_history(file_path, shift_types, solver, attempts, demand_table)
+        return False
+
+    def record_history(self, file_path, shift_types, solver, attempts, demand_table):
+        # キャッシュから返したシフト表も記録する。キャッシュを作ったときに履歴を残していたとは限らないため
+        if self.history is None:
+            return
+        parameters = {'shift_types': shift_types, 'solver': solver, 'attempts': attempts, 'start_date': self.start_date, 'limits': self.limits, 'demand': demand_table, 'target_hours': self.target_hours}
+        self.history.record(os.path.splitext(os.path.basename(file_path))[0], file_path, self, shift_types, parameters)
+
+    def prepare_preferences(self, preferences, shift_types):
+        validate_shift_types(shift_types)
+        with self.metrics.phase('prepare'):
+            day_columns = discover_day_columns(preferences.columns, self.start_date)
+            days = [label for _, label, _ in day_columns]
+            dates = [date for _, _, date in day_columns]
+            names = preferences['名前'].to_numpy()
+            preference_matrix = self.encode_preferences(preferences, [column for column, _, _ in day_columns], preference_labels(shift_types))
+        self.metrics.days = days
+        return names, days, dates, preference_matrix
+
+    def assign_days(self, preference_matrix, day_indices, employee_rows, schedule_matrix, shortage_counts, shift_types, demand_matrix, solver, progress=None, cancel_event=None, tracker=None, dates=None, fairness=None):
+        if solver not in SOLVERS:
+            raise ValueError(f"不明なソルバーです: {solver}")
+        labels = preference_labels(shift_types)
+        fill_codes = [tuple(labels.index(label) for label in shift_type.fillable) for shift_type in shift_types]
+        with self.metrics.phase('assign'):
+            # 候補者の配列は日数分まとめて作ると大きくなるため、DAY_CHUNK_SIZE 日ずつ作る
+            for chunk_start in range(0, len(day_indices), DAY_CHUNK_SIZE):
+                chunk_indices = day_indices[chunk_start:chunk_start + DAY_CHUNK_SIZE]
+                day_candidates = self.candidates_by_day(preference_matrix[:, chunk_indices], len(labels))
+                for k, i in enumerate(chunk_indices):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ScheduleCancelled("シフト割り当てが中止されました。")
+                    day_start = time.perf_counter()
+                    candidates = day_candidates[k]
+                    priority = blocked = None
+                    if tracker is not None:
+                        tracker.start_day(dates[i])
+                        candidates = [employees[tracker.eligible[employees]] for employees in candidates]
+                        priority, blocked = tracker.priority, tracker.blocked
+                    demands = demand_matrix[i].tolist()
+                    if fairness is not None:
+                        assigned = self.assign_shifts_for_day(candidates, fill_codes, demands, priority, blocked, fairness.load)
+                        fairness.record(assigned)
+                    elif solver in FLOW_SOLVERS:
+                        assigned = self.assign_shifts_for_day_optimal(candidates, fill_codes, demands, priority, blocked, solver == 'flow-any')
+                    else:
+                        assigned = self.assign_shifts_for_day(candidates, fill_codes, demands, priority, blocked)
+                    if tracker is not None:
+                        tracker.record(assigned)
+                    shortage_counts[i] = sum(max(demand - len(employees), 0) for demand, employees in zip(demands, assigned))
+                    schedule_matrix[:, i] = REST
+                    for code, employees in enumerate(assigned, 1):
+                        schedule_matrix[employee_rows[np.array(employees, dtype=np.intp)], i] = code
+                    self.metrics.record_day(i, time.perf_counter() - day_start)
+                    if progress is not None:
+                        progress(chunk_start + k + 1, len(day_indices))
+
+    def demand_matrix(self, shift_types, days, dates, demand_table=None):
+        # 日ごと・シフトごとの必要人数を最初に1つの表にまとめ、割り当て中は引くだけにする
+        demand_matrix = np.tile(np.array([shift_type.demand for shift_type in shift_types], dtype=np.int64), (len(days), 1))
+        if not demand_table:
+            return demand_matrix
+        shift_indices = {shift_type.label: k for k, shift_type in enumerate(shift_types)}
+        unknown = sorted({label for demands in demand_table.values() for label in demands if label not in shift_indices})
+        if unknown:
+            raise ValueError(f"必要人数表に不明なシフトがあります: {'、'.join(unknown)}")
+        for key, i in demand_day_indices(demand_table, days, dates).items():
+            for label, count in demand_table[key].items():
+                if count < 0:
+                    raise ValueError(f"必要人数表の人数に無効な値が設定されています: {key} {label}")
+                demand_matrix[i, shift_indices[label]] = count
+        return demand_matrix
+
+    def create_shift_schedule(self, preferences, shift_types, progress=None, cancel_event=None, solver='random', seed=None, demand_table=None, unavailable=None):
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.rng.seed(seed)
+        names, days, dates, preference_matrix = self.prepare_preferences(preferences, shift_types)
+        if unavailable:
+            self.block_unavailable(preference_matrix, names, days, dates, unavailable)
+        demand_matrix = self.demand_matrix(shift_types, days, dates, demand_table)
+        employee_rows, unique_names = pd.factorize(names)
+        schedule_matrix = np.full((len(unique_names), len(days)), REST, dtype=np.uint8)
+        shortage_counts = np.zeros(len(days), dtype=np.int64)
+        tracker = WorkloadTracker(self.limits, names, dates, len(shift_types)) if self.limits is not None else None
+        fairness = FairnessTracker(names, shift_types, self.target_hours) if solver == 'fair' else None
+        self.assign_days(preference_matrix, np.arange(len(days)), employee_rows, schedule_matrix, shortage_counts, shift_types, demand_matrix, solver, progress, cancel_event, tracker, dates, fairness)
+        totals = fairness.totals(employee_rows, len(unique_names)) if fairness is not None else None
+        self.shift_schedule = self.build_schedule_frame(unique_names, days, schedule_matrix, shortage_counts, shift_types, totals)
+        self.shortage_counts = shortage_counts
+        self.seed = seed
+        self.dates = dates
+        self.last_run = {
+            'names': names,
+            'days': days,
+            'dates': dates,
+            'preference_matrix': preference_matrix,
+            'schedule_matrix': schedule_matrix,
+            'demand_matrix': demand_matrix,
+            'parameters': ([(shift_type.label, shift_type.fillable) for shift_type in shift_types], solver),
         }
-        return shift_assignments
-
-    def create_shift_schedule(self, preferences, early_shift_count, late_shift_count):
-        new_columns = []
-        for col in preferences.columns:
-            if '希望日 [' in col:
-                new_col = col.replace('希望日 [', '').replace(']', '')
-                new_columns.append(new_col)
+
+    def block_unavailable(self, preference_matrix, names, days, dates, unavailable):
+        # unavailable: {名前: 入れない日の day_keys}。他の店舗で入っている日などを休みの希望に変える
+        columns = {key: i for i, key in enumerate(day_keys(days, dates))}
+        rows = {name: row for row, name in enumerate(names)}
+        for name, keys in unavailable.items():
+            if name in rows:
+                blocked = [columns[key] for key in keys if key in columns]
+                preference_matrix[rows[name], blocked] = REST
+
+    def update_shift_schedule(self, preferences, shift_types, progress=None, cancel_event=None, solver='random', demand_table=None, seed=None):
+        previous = self.last_run
+        names, days, dates, preference_matrix = self.prepare_preferences(preferences, shift_types)
+        demand_matrix = self.demand_matrix(shift_types, days, dates, demand_table)
+        # 勤務条件や公平な割り当ては前の日の割り当てに左右されるので、その場合は一部の日だけ作り直すことはできない
+        if (previous is None or self.limits is not None or solver == 'fair' or previous['days'] != days or previous['parameters'] != ([(shift_type.label, shift_type.fillable) for shift_type in shift_types], solver)
+                or not pd.Index(names).is_unique or not pd.Index(previous['names']).is_unique):
+            self.create_shift_schedule(preferences, shift_types, progress, cancel_event, solver, seed, demand_table)
+            return days
+
+        # 名前で前回の行に対応付け、希望が変わった行と増減した行から再計算が必要な日を求める
+        previous_rows = pd.Index(previous['names']).get_indexer(names)
+        known = previous_rows >= 0
+        removed = np.ones(len(previous['names']), dtype=bool)
+        removed[previous_rows[known]] = False
+        changed_days = (preference_matrix[known] != previous['preference_matrix'][previous_rows[known]]).any(axis=0)
+        changed_days |= (preference_matrix[~known] != REST).any(axis=0)
+        changed_days |= (previous['preference_matrix'][removed] != REST).any(axis=0)
+        changed_days |= (demand_matrix != previous['demand_matrix']).any(axis=1)
+        day_indices = np.flatnonzero(changed_days)
+
+        schedule_matrix = np.full((len(names), len(days)), REST, dtype=np.uint8)
+        schedule_matrix[known] = previous['schedule_matrix'][previous_rows[known]]
+        shortage_counts = self.shortage_counts.copy()
+        self.assign_days(preference_matrix, day_indices, np.arange(len(names)), schedule_matrix, shortage_counts, shift_types, demand_matrix, solver, progress, cancel_event)
+        self.shift_schedule = self.build_schedule_frame(names, days, schedule_matrix, shortage_counts, shift_types)
+        self.shortage_counts = shortage_counts
+        # 一部の日だけ作り直したシフト表は、どのシードからも作り直せないので、シードは残さない
+        self.seed = None
+        self.last_run = dict(previous, names=names, preference_matrix=preference_matrix, schedule_matrix=schedule_matrix, demand_matrix=demand_matrix)
+        return [days[i] for i in day_indices]
+
+    def create_best_shift_schedule(self, preferences, shift_types, attempts, workers=None, solver='random', seed=None, progress=None, cancel_event=None, demand_table=None, unavailable=None):
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        seeds = [(seed + i) % 2 ** 32 for i in range(attempts)]
+        results = []
+        with self.metrics.phase('assign'):
+            if workers == 1:
+                for attempt_seed in seeds:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ScheduleCancelled("シフト割り当てが中止されました。")
+                    results.append(run_schedule_attempt(preferences, shift_types, solver, attempt_seed, self.options(), demand_table, unavailable, cancel_event))
+                    if progress is not None:
+                        progress(len(results), attempts)
             else:
-                new_columns.append(col)
-        preferences.columns = new_columns
-
-        shift_schedule = pd.DataFrame(index=preferences['名前'].unique())
-        shortage_list = []
-        for day in [f'{i}日' for i in range(1, 32) if f'{i}日' in preferences.columns]:
-            daily_shifts = self.assign_shifts_for_day(preferences, day, early_shift_count, late_shift_count)
-            if len(daily_shifts['早番']) < early_shift_count or len(daily_shifts['遅番']) < late_shift_count:
-                shortage_list.append(day)
-            for shift_type, names in daily_shifts.items():
-                for name in names:
-                    shift_schedule.loc[name, day] = shift_type
-            shift_schedule[day] = shift_schedule[day].fillna('休み')
-        shift_schedule.loc['不足'] = ['不足' if day in shortage_list else '' for day in shift_schedule.columns]
-        self.shift_schedule = shift_schedule
-
-class ShiftSchedulerApp:
-    def __init__(self, root):
-        self.root = root
-        self.scheduler = ShiftScheduler()
-        self.selected_file_path = None
-        self.early_shift_count = 2
-        self.late_shift_count = 2
-        self.setup_ui()
-
-    def is_valid_number(self, value):
+                import multiprocessing
+                from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+                # 中止されたら、実行中の試行にも日の区切りで止まるように知らせる
+                stop_workers = multiprocessing.Event()
+                with ProcessPoolExecutor(max_workers=workers, initializer=init_attempt_worker, initargs=(stop_workers,)) as executor:
+                    pending = {executor.submit(run_schedule_attempt, preferences, shift_types, solver, attempt_seed, self.options(), demand_table, unavailable) for attempt_seed in seeds}
+                    while pending:
+                        finished, pending = wait(pending, timeout=CANCEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                        if cancel_event is not None and cancel_event.is_set():
+                            stop_workers.set()
+                            executor.shutdown(wait=False, cancel_futures=True)
+                            raise ScheduleCancelled("シフト割り当てが中止されました。")
+                        for future in finished:
+                            results.append(future.result())
+                            if progress is not None:
+                                progress(len(results), attempts)
+        score, _, best = min(results, key=lambda result: (result[0], result[1]))
+        self.shift_schedule = best.shift_schedule
+        self.shortage_counts = best.shortage_counts
+        self.seed = best.seed
+        self.last_run = best.last_run
+        self.dates = best.dates
+        return score
+
+    def score_schedule(self):
+        worked = (self.last_run['schedule_matrix'] != REST).sum(axis=1)
+        fairness_spread = int(worked.max() - worked.min()) if len(worked) else 0
+        return int(self.shortage_counts.sum()), fairness_spread
+
+    def build_schedule_frame(self, names, days, schedule_matrix, shortage_counts, shift_types, totals=None):
+        # 各日の列はシフト名のカテゴリ型にして、1マス1バイトで持つ。
+        # 不足の行には「2人不足」のように足りない人数を入れる。totals があれば最後に合計の列を足し、
+        # 不足の行のところに勤務の差を入れる
+        with self.metrics.phase('build'):
+            max_shortage = int(shortage_counts.max()) if len(shortage_counts) else 0
+            labels = output_labels(shift_types, max_shortage)
+            shortage_row = np.where(shortage_counts > 0, len(shift_types) + shortage_counts, len(labels) - 1)
+            codes = np.vstack([schedule_matrix, shortage_row]).astype(np.int16)
+            columns = {day: pd.Categorical.from_codes(codes[:, i], categories=labels) for i, day in enumerate(days)}
+            if totals is None:
+                return pd.DataFrame(columns, index=list(names) + ['不足'], columns=days)
+            cells, spread = totals
+            columns[TOTAL_COLUMN] = pd.Categorical(cells + [spread])
+            return pd.DataFrame(columns, index=list(names) + ['不足'], columns=list(days) + [TOTAL_COLUMN])
+
+    def shortage_days(self):
+        shortage_row = self.shift_schedule.loc['不足'].drop(TOTAL_COLUMN, errors='ignore')
+        return shortage_row[shortage_row != ''].index.tolist()
+
+    def save_schedule(self, file_path, file_format=None):
+        writer = SCHEDULE_WRITERS[schedule_format(file_path, file_format)]
+        with self.metrics.phase('save'):
+            writer(self.shift_schedule, file_path)
+
+def schedule_format(file_path, file_format=None):
+    if file_format is None:
+        file_format = SCHEDULE_FORMATS.get(os.path.splitext(file_path)[1].lower(), 'csv')
+    if file_format not in SCHEDULE_WRITERS:
+        raise ValueError(f"不明な出力形式です: {file_format}")
+    return file_format
+
+def import_optional(name, format_label):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise Exception(f"{format_label}形式で保存するには {name.split('.')[0]} をインストールしてください。")
+
+def iter_schedule_chunks(schedule):
+    for start in range(0, len(schedule), SAVE_CHUNK_ROWS):
+        yield schedule.iloc[start:start + SAVE_CHUNK_ROWS]
+
+def schedule_labels(schedule):
+    if len(schedule.columns) and isinstance(schedule.dtypes.iloc[0], pd.CategoricalDtype):
+        return list(schedule.dtypes.iloc[0].categories)
+    return output_labels(default_shift_types())
+
+def schedule_record_batch(pa, chunk, labels):
+    # シフト名は辞書エンコードし、セルごとには1バイトの番号だけを持たせる
+    dictionary = pa.array(labels)
+    index_type = pa.int8() if len(labels) <= 127 else pa.int16()
+    arrays = [pa.array([str(name) for name in chunk.index], type=pa.string())]
+    for day in chunk.columns:
+        if day == TOTAL_COLUMN:
+            # 合計の列はシフト名ではないので、そのまま文字列で持つ
+            arrays.append(pa.array(chunk[day].astype(str).tolist(), type=pa.string()))
+            continue
+        codes = pd.Categorical(chunk[day], categories=labels).codes
+        arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes, type=index_type, mask=codes < 0), dictionary))
+    return pa.RecordBatch.from_arrays(arrays, names=['名前'] + [str(day) for day in chunk.columns])
+
+def write_schedule_csv(schedule, file_path):
+    schedule.to_csv(file_path, index=True, chunksize=SAVE_CHUNK_ROWS)
+
+def write_schedule_parquet(schedule, file_path):
+    pa = import_optional('pyarrow', 'Parquet')
+    pq = import_optional('pyarrow.parquet', 'Parquet')
+    labels = schedule_labels(schedule)
+    writer = None
+    try:
+        for chunk in iter_schedule_chunks(schedule):
+            batch = schedule_record_batch(pa, chunk, labels)
+            if writer is None:
+                writer = pq.ParquetWriter(file_path, batch.schema)
+            writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def write_schedule_feather(schedule, file_path):
+    pa = import_optional('pyarrow', 'Feather')
+    labels = schedule_labels(schedule)
+    with pa.OSFile(file_path, 'wb') as sink:
+        writer = None
         try:
-            return int(value) >= 0
-        except ValueError:
-            return False
-
-    def setup_ui(self):
-        self.root.title("シフトスケジュール作成ツール")
-        style = ttk.Style()
-        style.configure('TButton', font=('Helvetica', 12), padding=10)
-        style.configure('TLabel', font=('Helvetica', 12), padding=10)
-        self.file_path_label = ttk.Label(self.root, text="ファイルが選択されていません")
-        self.file_path_label.grid(row=0, column=0, columnspan=2, pady=10, padx=10, sticky="w")
-        self.select_file_button = ttk.Button(self.root, text="ファイルを選択", command=self.select_file)
-        early_shift_label = ttk.Label(self.root, text="早番の必要人数")
-        early_shift_label.grid(row=3, column=0, pady=10, padx=10, sticky="e")
-        self.early_shift_spinner = ttk.Spinbox(self.root, from_=0, to=10, increment=1, wrap=True)
-        self.early_shift_spinner.set(self.early_shift_count)
-        self.early_shift_spinner.grid(row=3, column=1, pady=10, padx=10, sticky="w")
-        late_shift_label = ttk.Label(self.root, text="遅番の必要人数")
-        late_shift_label.grid(row=4, column=0, pady=10, padx=10, sticky="e")
-        self.late_shift_spinner = ttk.Spinbox(self.root, from_=0, to=10, increment=1, wrap=True)
-        self.late_shift_spinner.set(self.late_shift_count)
-        self.late_shift_spinner.grid(row=4, column=1, pady=10, padx=10, sticky="w")
-        self.select_file_button.grid(row=1, column=0, pady=10, padx=10, sticky="ew")
-        self.start_button = ttk.Button(self.root, text="シフト割り当て開始", command=self.start_shift_assignment)
-        self.start_button.grid(row=1, column=1, pady=10, padx=10, sticky="ew")
-        self.save_button = ttk.Button(self.root, text="結果を保存", command=self.save_results)
-        self.save_button.grid(row=2, column=0, pady=10, padx=10, sticky="ew")
-        self.exit_button = ttk.Button(self.root, text="終了", command=self.exit_application)
-        self.exit_button.grid(row=2, column=1, pady=10, padx=10, sticky="ew")
-        self.root.grid_rowconfigure(1, weight=1)
-        self.root.grid_rowconfigure(2, weight=1)
-        self.root.grid_columnconfigure(0, weight=1)
-        self.root.grid_columnconfigure(1, weight=1)
-        self.root.geometry('600x300')
-        self.center_window()
-
-    def center_window(self):
-        self.root.update_idletasks()
-        width = self.root.winfo_width()
-        height = self.root.winfo_height()
-        screen_width = self.root.winfo_screenwidth()
-        screen_height = self.root.winfo_screenheight()
-        x = int((screen_width / 2) - (width / 2))
-        y = int((screen_height / 2) - (height / 2))
-        self.root.geometry(f'{width}x{height}+{x}+{y}')
-
-    def select_file(self):
-        file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
-        if file_path:
-            self.selected_file_path = file_path
-            filename = os.path.basename(file_path)
-            self.file_path_label.config(text=filename)
-
-    def start_shift_assignment(self):
-        if self.selected_file_path is None:
-            messagebox.showwarning("警告", "ファイルが選択されていません。")
-            return
-        early_shift_count = self.early_shift_spinner.get()
-        late_shift_count = self.late_shift_spinner.get()
-        if not self.is_valid_number(early_shift_count) or not self.is_valid_number(late_shift_count):
-            messagebox.showerror("エラー", "早番または遅番の人数に無効な値が設定されています。")
-            return
-        early_shift_count = int(early_shift_count)
-        late_shift_count = int(late_shift_count)
+            for chunk in iter_schedule_chunks(schedule):
+                batch = schedule_record_batch(pa, chunk, labels)
+                if writer is None:
+                    writer = pa.ipc.new_file(sink, batch.schema)
+                writer.write_batch(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+
+def write_schedule_xlsx(schedule, file_path):
+    openpyxl = import_optional('openpyxl', 'Excel')
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('シフト表')
+    sheet.append([''] + [str(day) for day in schedule.columns])
+    for chunk in iter_schedule_chunks(schedule):
+        for name, row in zip(chunk.index, chunk.itertuples(index=False, name=None)):
+            sheet.append([name, *row])
+    workbook.save(file_path)
+
+SCHEDULE_WRITERS = {
+    'csv': write_schedule_csv,
+    'parquet': write_schedule_parquet,
+    'feather': write_schedule_feather,
+    'xlsx': write_schedule_xlsx,
+}
+
+def collect_input_files(inputs):
+    file_paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(glob.glob(os.path.join(item, '*.csv')))
+        elif glob.has_magic(item):
+            matches = sorted(glob.glob(item))
+        else:
+            matches = [item]
+        file_paths.extend(path for path in matches if path not in file_paths)
+    return file_paths
+
+attempt_cancel_event = None
+
+def init_attempt_worker(cancel_event):
+    global attempt_cancel_event
+    attempt_cancel_event = cancel_event
+
+def run_schedule_attempt(preferences, shift_types, solver, seed, options=None, demand_table=None, unavailable=None, cancel_event=None):
+    scheduler = ShiftScheduler(**(options or {}))
+    scheduler.create_shift_schedule(preferences, shift_types, cancel_event=cancel_event or attempt_cancel_event, solver=solver, seed=seed, demand_table=demand_table, unavailable=unavailable)
+    return scheduler.score_schedule(), seed, scheduler
+
+process_caches = {}
+
+def process_cache(cache_dir=None):
+    # プロセスごとにキャッシュを1つだけ作って使い回す。監視モードのように同じワーカーに
+    # 続けて依頼が来る場合は、同じ条件の実行をディスクを読まずにメモリから返せる
+    cache = process_caches.get(cache_dir)
+    if cache is None:
+        cache = process_caches[cache_dir] = ScheduleCache(cache_dir=cache_dir)
+    return cache
+
+def schedule_file(file_path, output_path, shift_types, solver='random', attempts=1, seed=None, cache_dir=None, metrics_path=None, profile=False, file_format='csv', start_date=None, limits=None, demand_table=None, history_path=None, target_hours=None):
+    history = ScheduleHistory(history_path) if history_path else None
+    scheduler = ShiftScheduler(cache=process_cache(cache_dir) if cache_dir else None, profile=profile, start_date=start_date, limits=limits, history=history, target_hours=target_hours)
+    try:
+        cache_hit = scheduler.schedule_from_file(file_path, shift_types, solver=solver, seed=seed, attempts=attempts, workers=1, demand_table=demand_table)
+    finally:
+        if history is not None:
+            history.close()
+    scheduler.save_schedule(output_path, file_format)
+    if metrics_path is not None:
+        with open(metrics_path, 'w', encoding='utf-8') as f:
+            f.write(scheduler.metrics.to_json())
+    if profile:
+        scheduler.metrics.dump_profile(f'{os.path.splitext(metrics_path)[0]}.prof')
+    elapsed = sum(timing['wall'] for timing in scheduler.metrics.phases.values())
+    return scheduler.shortage_days(), int(scheduler.shortage_counts.sum()), scheduler.seed, cache_hit, elapsed, summarize_issues(scheduler.issues)
+
+def summary_row(store, future):
+    try:
+        return result_row(store, future.result())
+    except Exception as e:
+        return error_row(store, e)
+
+def result_row(store, result):
+    shortage_days, shortage_count, store_seed, cache_hit, elapsed, issues = result
+    return {'店舗': store, '不足日数': len(shortage_days), '不足人数': shortage_count, '不足日': ' '.join(shortage_days), '乱数シード': store_seed, 'キャッシュ': cache_hit, '処理時間(秒)': round(elapsed, 3), '警告': ' / '.join(issues), 'エラー': ''}
+
+def error_row(store, error):
+    return {'店舗': store, '不足日数': None, '不足人数': None, '不足日': '', '乱数シード': None, 'キャッシュ': False, '処理時間(秒)': None, '警告': '', 'エラー': str(error)}
+
+def summary_frame(rows):
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+    for column in ('不足日数', '不足人数', '乱数シード'):
+        summary[column] = summary[column].astype('Int64')
+    return summary
+
+def print_summary_row(row):
+    if row.エラー:
+        print(f"{row.店舗}: エラー {row.エラー}")
+    else:
+        print(f"{row.店舗}: 不足 {row.不足日数}日 {row.不足人数}人" + (f" ({row.不足日})" if row.不足日 else "") + f" シード {row.乱数シード}")
+        if row.警告:
+            print(f"{row.店舗}: 警告 {row.警告}")
+
+def run_batch(file_paths, output_dir, shift_types, workers=None, solver='random', attempts=1, seed=None, cache_dir=None, metrics=False, profile=False, file_format='csv', start_date=None, limits=None, demand_table=None, history_path=None, target_hours=None):
+    from concurrent.futures import ProcessPoolExecutor
+    os.makedirs(output_dir, exist_ok=True)
+    summary = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=random.seed) as executor:
+        futures = []
+        for file_path in file_paths:
+            store = os.path.splitext(os.path.basename(file_path))[0]
+            output_path = os.path.join(output_dir, f'{store}_shift_schedule.{file_format}')
+            metrics_path = os.path.join(output_dir, f'{store}_metrics.json') if metrics or profile else None
+            futures.append((store, executor.submit(schedule_file, file_path, output_path, shift_types, solver, attempts, seed, cache_dir, metrics_path, profile, file_format, start_date, limits, demand_table, history_path, target_hours)))
+        for store, future in futures:
+            summary.append(summary_row(store, future))
+    summary = summary_frame(summary)
+    summary.to_csv(os.path.join(output_dir, 'summary.csv'), index=False)
+    return summary
+
+def find_root(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def union_all(parent, items):
+    root = find_root(parent, items[0])
+    for item in items[1:]:
+        parent[find_root(parent, item)] = root
+
+def site_identities(sheets):
+    # 店舗ごとの希望シフトから同じ人を見つけ、人の番号を店舗ごとの配列で返す。メールアドレスが
+    # 同じなら同じ人とし、メールアドレスのない行は、その名前の人が1人に決まる場合だけ名前で対応付ける。
+    # 1つの店舗の中で複数の人が使っているメールアドレスは本人を特定できないので、ない扱いにする。
+    # 共有スタッフでつながる店舗を1つのグループにまとめ、グループの一覧と2店舗以上に出てくる人の番号も返す
+    frames = []
+    for sheet in sheets:
+        emails = sheet['メールアドレス'].str.strip().str.lower() if 'メールアドレス' in sheet.columns else pd.Series(None, index=sheet.index, dtype=object)
+        emails = emails.where((emails != '') & ~emails.duplicated(keep=False))
+        frames.append(pd.DataFrame({'名前': sheet['名前'].to_numpy(), 'メールアドレス': emails.to_numpy()}))
+    people = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['名前', 'メールアドレス'])
+    parent = list(range(len(people)))
+    for rows in people.groupby('メールアドレス').indices.values():
+        union_all(parent, rows.tolist())
+    no_email = people['メールアドレス'].isna().to_numpy()
+    for rows in people.groupby('名前').indices.values():
+        if len(rows) < 2 or not no_email[rows].any():
+            continue
+        # 同じ名前でもメールアドレスの違う人が複数いる場合は、メールアドレスのない行をどちらにも付けない
+        if len({find_root(parent, row) for row in rows[~no_email[rows]].tolist()}) > 1:
+            rows = rows[no_email[rows]]
+        if len(rows) > 1:
+            union_all(parent, rows.tolist())
+    person_ids = pd.factorize(np.array([find_root(parent, i) for i in range(len(people))], dtype=np.int64))[0]
+    bounds = np.cumsum([0] + [len(sheet) for sheet in sheets])
+    person_ids = [person_ids[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    sites_by_person = {}
+    for i, ids in enumerate(person_ids):
+        for person in np.unique(ids).tolist():
+            sites_by_person.setdefault(person, []).append(i)
+    site_parent = list(range(len(sheets)))
+    shared = set()
+    for person, indices in sites_by_person.items():
+        if len(indices) > 1:
+            shared.add(person)
+            union_all(site_parent, indices)
+    groups = {}
+    for i in range(len(sheets)):
+        groups.setdefault(find_root(site_parent, i), []).append(i)
+    return person_ids, list(groups.values()), shared
+
+def schedule_site_group(sites, shift_types, solver='random', attempts=1, seed=None, options=None, demand_table=None, file_format='csv', history_path=None):
+    # sites: 共有スタッフでつながる店舗の (店舗名, 入力, 出力, 希望シフト, 人の番号, 警告) の一覧。
+    # 前の店舗で入った日は共有スタッフの希望を休みにしてから次の店舗を割り当てるので、二重に入ることはない
+    booked = {}
+    results = []
+    history = ScheduleHistory(history_path) if history_path else None
+    try:
+        for store, file_path, output_path, preferences, person_ids, issues in sites:
+            try:
+                scheduler = ShiftScheduler(**(options or {}))
+                if history is not None:
+                    history.check_dates([date for _, _, date in discover_day_columns(preferences.columns, scheduler.start_date)])
+                names = preferences['名前'].to_numpy()
+                unavailable = {name: booked[person] for name, person in zip(names, person_ids.tolist()) if person in booked}
+                if attempts > 1:
+                    scheduler.create_best_shift_schedule(preferences, shift_types, attempts, workers=1, solver=solver, seed=seed, demand_table=demand_table, unavailable=unavailable)
+                else:
+                    scheduler.create_shift_schedule(preferences, shift_types, solver=solver, seed=seed, demand_table=demand_table, unavailable=unavailable)
+                scheduler.save_schedule(output_path, file_format)
+                keys = np.array(day_keys(scheduler.last_run['days'], scheduler.last_run['dates']), dtype=object)
+                rows = {name: row for row, name in enumerate(scheduler.shift_schedule.index[:-1])}
+                working = scheduler.last_run['schedule_matrix'] != REST
+                if len(sites) > 1:
+                    for name, person in zip(names, person_ids.tolist()):
+                        booked.setdefault(person, set()).update(keys[working[rows[name]]].tolist())
+                if history is not None:
+                    parameters = {'shift_types': shift_types, 'solver': solver, 'attempts': attempts, 'start_date': scheduler.start_date, 'limits': scheduler.limits,
+                                  'demand': demand_table, 'target_hours': scheduler.target_hours, 'sites': [site[0] for site in sites]}
+                    history.record(store, file_path, scheduler, shift_types, parameters)
+                elapsed = sum(timing['wall'] for timing in scheduler.metrics.phases.values())
+                results.append((scheduler.shortage_days(), int(scheduler.shortage_counts.sum()), scheduler.seed, False, elapsed, issues))
+            except Exception as e:
+                results.append(e)
+    finally:
+        if history is not None:
+            history.close()
+    return results
+
+def run_sites(file_paths, output_dir, shift_types, workers=None, solver='random', attempts=1, seed=None, file_format='csv', start_date=None, limits=None, demand_table=None, history_path=None, target_hours=None):
+    # 複数の店舗をまとめて割り当てる。共有スタッフのいないグループどうしは並列に実行する
+    from concurrent.futures import ProcessPoolExecutor
+    os.makedirs(output_dir, exist_ok=True)
+    loader = ShiftScheduler(start_date=start_date)
+    rows = {}
+    sites = []
+    for file_path in file_paths:
+        store = os.path.splitext(os.path.basename(file_path))[0]
         try:
-            preferences = self.scheduler.load_preferences(self.selected_file_path)
-            self.scheduler.create_shift_schedule(preferences, early_shift_count, late_shift_count)
-            messagebox.showinfo("完了", "シフト割り当てが完了しました。")
+            preferences = loader.load_preferences(file_path, shift_types, with_email=True)
         except Exception as e:
-            messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました: {e}")
+            rows[store] = error_row(store, e)
+            continue
+        output_path = os.path.join(output_dir, f'{store}_shift_schedule.{file_format}')
+        sites.append((store, file_path, output_path, preferences, summarize_issues(loader.issues)))
+    person_ids, groups, shared = site_identities([site[3] for site in sites])
+    options = {'start_date': start_date, 'limits': limits, 'target_hours': target_hours}
+    with ProcessPoolExecutor(max_workers=workers, initializer=random.seed) as executor:
+        futures = []
+        for group in groups:
+            group_sites = [sites[i][:4] + (person_ids[i], sites[i][4]) for i in group]
+            futures.append(([sites[i][0] for i in group], executor.submit(schedule_site_group, group_sites, shift_types, solver, attempts, seed, options, demand_table, file_format, history_path)))
+        for stores, future in futures:
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [e] * len(stores)
+            for store, result in zip(stores, results):
+                rows[store] = error_row(store, result) if isinstance(result, Exception) else result_row(store, result)
+    summary = summary_frame([rows[os.path.splitext(os.path.basename(file_path))[0]] for file_path in file_paths])
+    summary.to_csv(os.path.join(output_dir, 'summary.csv'), index=False)
+    shared_groups = [([sites[i][0] for i in group], len(shared & set(np.concatenate([person_ids[i] for i in group]).tolist()))) for group in groups if len(group) > 1]
+    return summary, shared_groups
 
-    def save_results(self):
-        if self.scheduler.shift_schedule is None:
-            messagebox.showwarning("警告", "まだシフト割り当てが行われていません。")
-            return
-        save_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
-        if save_path:
-            self.scheduler.shift_schedule.to_csv(save_path, index=True)
-            messagebox.showinfo("保存", "シフト表を保存しました。")
+def parse_month(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise ValueError(f"年月はYYYY-MMの形式で指定してください: {value}")
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="シフトスケジュール作成ツール。入力を指定しない場合はGUIを起動します。")
+    parser.add_argument('inputs', nargs='*', help="希望シフトのCSVファイル、ディレクトリ、またはglobパターン")
+    parser.add_argument('--early', type=int, default=2, help="早番の必要人数 (デフォルト: 2)")
+    parser.add_argument('--late', type=int, default=2, help="遅番の必要人数 (デフォルト: 2)")
+    parser.add_argument('--shift-types', default=None, help="シフト定義のCSV (シフト, 必要人数, 入れる希望)。指定した場合は--early/--lateは使いません")
+    parser.add_argument('--demand', default=None, help="日ごとの必要人数表のCSV (日付, シフト名ごとの人数)。書かれていない日はシフト定義の人数を使います")
+    parser.add_argument('--solver', choices=SOLVERS, default='random', help="割り当て方法。flowは最小費用流で希望したシフトの中から不足を最小化し、flow-anyは希望していないシフトにも入れて不足を減らします。fairはそれまでの勤務が少ない人から割り当てて勤務日数をそろえます (デフォルト: random)")
+    parser.add_argument('--target-hours', default=None, help="--solver fairで使う従業員ごとの目標時間のCSV (名前, 目標時間)")
+    parser.add_argument('--attempts', type=int, default=1, help="試行回数。2以上の場合は最も良いシフト表を採用します (デフォルト: 1)")
+    parser.add_argument('--seed', type=int, default=None, help="乱数シード。同じシードで同じシフト表を再現できます")
+    parser.add_argument('--cache-dir', default=None, help="シフト表のキャッシュを保存するディレクトリ。同じファイルを同じ条件と乱数シードで作り直すときに使います")
+    parser.add_argument('--metrics', action='store_true', help="処理ごとの時間を店舗ごとのJSONファイルに出力します")
+    parser.add_argument('--profile', action='store_true', help="cProfileの結果も含めて出力します (--metricsを含みます)")
+    parser.add_argument('--format', choices=list(SCHEDULE_WRITERS), default='csv', help="シフト表の出力形式 (デフォルト: csv)")
+    parser.add_argument('--start-month', type=parse_month, default=None, help="「1日」のように月のない希望日の列を割り当てる年月 (例: 2024-04)")
+    parser.add_argument('--max-shifts', type=int, default=None, help="1人あたりの期間中の最大勤務日数")
+    parser.add_argument('--min-shifts', type=int, default=None, help="1人あたりの期間中の最低勤務日数 (できるだけ満たすように優先します)")
+    parser.add_argument('--max-consecutive', type=int, default=None, help="最大連続勤務日数")
+    parser.add_argument('--no-late-to-early', action='store_true', help="前日より開始の早いシフト (遅番の翌日の早番など) を入れません")
+    parser.add_argument('--limit-period', choices=LIMIT_PERIODS, default='all', help="勤務日数を数える期間 (all: 全期間, month: 月ごと, week: 週ごと)")
+    parser.add_argument('--limits-file', default=None, help="従業員ごとの勤務条件のCSV (名前, 最大勤務日数, 最小勤務日数, 最大連続勤務日数)")
+    parser.add_argument('--history', default=None, help="読み込んだ希望シフトと作成したシフト表を記録するSQLiteファイル")
+    parser.add_argument('-o', '--output-dir', default='output', help="シフト表の出力先ディレクトリ (デフォルト: output)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="並列実行するプロセス数 (デフォルト: CPUコア数)")
+    parser.add_argument('--multi-site', action='store_true', help="入力を同じスタッフを共有する店舗として扱い、同じ人が同じ日に2つの店舗に入らないように割り当てます")
+    parser.add_argument('--watch', default=None, metavar='INBOX', help="指定したディレクトリを監視し、置かれた希望シフトCSVから順にシフト表を--output-dirに作成し続けます")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="--watch時にディレクトリを確認する間隔の秒数 (デフォルト: 1.0)")
+    parser.add_argument('--settle', type=float, default=2.0, help="--watch時、ファイルの更新が止まってから処理を始めるまでの秒数 (デフォルト: 2.0)")
+    args = parser.parse_args(argv)
+
+    if args.watch is not None and args.inputs:
+        parser.error("--watchを指定した場合は入力ファイルを指定できません。")
+    if args.watch is not None and args.multi_site:
+        parser.error("--multi-siteと--watchは同時に指定できません。")
+    if args.watch is not None and (args.metrics or args.profile):
+        parser.error("--watchでは--metrics、--profileは使えません。")
+    if args.multi_site and (args.cache_dir is not None or args.metrics or args.profile):
+        parser.error("--multi-siteでは--cache-dir、--metrics、--profileは使えません。")
+    if not args.inputs and args.watch is None:
+        from shift_scheduler_app import run_app
+        run_app()
+        return 0
+    shift_types = load_shift_types(args.shift_types) if args.shift_types is not None else default_shift_types(args.early, args.late)
+    try:
+        validate_shift_types(shift_types)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.attempts < 1:
+        parser.error("試行回数は1以上を指定してください。")
+    if args.target_hours is not None and args.solver != 'fair':
+        parser.error("--target-hoursは--solver fairと一緒に指定してください。")
+    if any(value is not None and value < 0 for value in (args.max_shifts, args.min_shifts, args.max_consecutive)):
+        parser.error("勤務日数の条件に無効な値が設定されています。")
+    if args.watch is not None and not os.path.isdir(args.watch):
+        parser.error(f"監視するディレクトリが見つかりません: {args.watch}")
+    file_paths = collect_input_files(args.inputs)
+    if not file_paths and args.watch is None:
+        parser.error("CSVファイルが見つかりません。")
+    demand_table = load_demand_table(args.demand) if args.demand is not None else None
+    target_hours = load_target_hours(args.target_hours) if args.target_hours is not None else None
+    limits = None
+    if (args.max_shifts is not None or args.min_shifts is not None or args.max_consecutive is not None
+            or args.no_late_to_early or args.limits_file is not None):
+        overrides = WorkloadLimits.load_overrides(args.limits_file) if args.limits_file is not None else None
+        limits = WorkloadLimits(args.max_shifts, args.min_shifts, args.max_consecutive, args.no_late_to_early, args.limit_period, overrides)
+
+    if args.watch is not None:
+        from shift_scheduler_watcher import InboxWatcher
+        watcher = InboxWatcher(args.watch, args.output_dir, shift_types, args.workers, args.poll_interval, args.settle,
+                               solver=args.solver, attempts=args.attempts, seed=args.seed, cache_dir=args.cache_dir, file_format=args.format,
+                               start_date=args.start_month, limits=limits, demand_table=demand_table, history_path=args.history, target_hours=target_hours)
+        print(f"{args.watch} を監視しています (出力先 {args.output_dir}, 停止はCtrl+C)")
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.multi_site:
+        summary, shared_groups = run_sites(file_paths, args.output_dir, shift_types, args.workers, args.solver, args.attempts, args.seed, args.format, args.start_month, limits, demand_table, args.history, target_hours)
+        for stores, shared_count in shared_groups:
+            print(f"共有スタッフ {shared_count}人: {'、'.join(stores)}")
+    else:
+        summary = run_batch(file_paths, args.output_dir, shift_types, args.workers, args.solver, args.attempts, args.seed, args.cache_dir, args.metrics, args.profile, args.format, args.start_month, limits, demand_table, args.history, target_hours)
+    for row in summary.itertuples(index=False):
+        print_summary_row(row)
+    if args.cache_dir is not None:
+        print(f"キャッシュ: ヒット {int(summary['キャッシュ'].sum())}件 / ミス {int((~summary['キャッシュ']).sum())}件")
+    return 1 if (summary['エラー'] != '').any() else 0
 
-    def exit_application(self):
-        self.root.destroy()
+def __getattr__(name):
+    if name == 'ShiftSchedulerApp':
+        from shift_scheduler_app import ShiftSchedulerApp
+        return ShiftSchedulerApp
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = ShiftSchedulerApp(root)
-    root.mainloop()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,411 @@
+import tkinter as tk
+from tkinter import filedialog
+from tkinter import messagebox
+from tkinter import ttk
+import os
+import queue
+import threading
+from shift_scheduler import REST_LABEL, ScheduleCache, ScheduleCancelled, ShiftScheduler, default_shift_types, lazy_import, load_demand_table, load_shift_types, summarize_issues
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+SAVE_FILE_TYPES = [
+    ("CSV files", "*.csv"),
+    ("Excel files", "*.xlsx"),
+    ("Parquet files", "*.parquet"),
+    ("Feather files", "*.feather"),
+]
+SHIFT_COLORS = ['#dbeafe', '#fef3c7', '#dcfce7', '#ede9fe', '#fce7f3', '#cffafe']
+SHORTAGE_COLOR = '#fecaca'
+SHORTAGE_DAY_COLOR = '#fff1f2'
+
+class ScheduleGrid:
+    # 見えている範囲のマスだけをCanvasに描くので、5000人×90日のシフト表でもスクロールが重くならない
+    ROW_HEIGHT = 24
+    HEADER_HEIGHT = 26
+    NAME_WIDTH = 140
+    CELL_WIDTH = 64
+
+    def __init__(self, master):
+        self.frame = ttk.Frame(master)
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add('write', self.apply_filter)
+        filter_label = ttk.Label(self.frame, text="名前で絞り込み")
+        filter_label.grid(row=0, column=0, sticky="w")
+        filter_entry = ttk.Entry(self.frame, textvariable=self.filter_var)
+        filter_entry.grid(row=0, column=1, columnspan=2, pady=5, padx=5, sticky="ew")
+        self.canvas = tk.Canvas(self.frame, background='white', highlightthickness=0)
+        self.canvas.grid(row=1, column=0, columnspan=2, sticky="nsew")
+        self.vertical_bar = ttk.Scrollbar(self.frame, orient="vertical", command=self.scroll_rows)
+        self.vertical_bar.grid(row=1, column=2, sticky="ns")
+        self.horizontal_bar = ttk.Scrollbar(self.frame, orient="horizontal", command=self.scroll_columns)
+        self.horizontal_bar.grid(row=2, column=0, columnspan=2, sticky="ew")
+        self.frame.grid_rowconfigure(1, weight=1)
+        self.frame.grid_columnconfigure(1, weight=1)
+        self.canvas.bind('<Configure>', lambda event: self.redraw())
+        self.canvas.bind('<MouseWheel>', lambda event: self.scroll_rows('scroll', -1 if event.delta > 0 else 1, 'units', 3))
+        self.canvas.bind('<Shift-MouseWheel>', lambda event: self.scroll_columns('scroll', -1 if event.delta > 0 else 1, 'units'))
+        self.canvas.bind('<Button-4>', lambda event: self.scroll_rows('scroll', -1, 'units', 3))
+        self.canvas.bind('<Button-5>', lambda event: self.scroll_rows('scroll', 1, 'units', 3))
+        self.names = np.array([], dtype=object)
+        self.days = []
+        self.labels = []
+        self.codes = np.zeros((0, 0), dtype=np.int8)
+        self.shortage_codes = np.zeros(0, dtype=np.int8)
+        self.shortage_days = np.zeros(0, dtype=bool)
+        self.colors = {}
+        self.rows = np.arange(0)
+        self.first_row = 0
+        self.first_column = 0
+
+    def set_schedule(self, schedule):
+        # セルの文字列は作らず、カテゴリ型の番号のまま持っておき、描くときにだけ名前に変える
+        self.names = schedule.index[:-1].to_numpy(dtype=object)
+        self.days = [str(day) for day in schedule.columns]
+        self.labels = list(schedule.dtypes.iloc[0].categories) if len(schedule.columns) else []
+        codes = np.empty((len(schedule), len(schedule.columns)), dtype=np.int16)
+        for i, day in enumerate(schedule.columns):
+            codes[:, i] = schedule[day].cat.codes.to_numpy()
+        self.codes = codes[:-1]
+        self.shortage_codes = codes[-1]
+        blank = self.labels.index('') if '' in self.labels else -1
+        self.shortage_days = self.shortage_codes != blank
+        self.colors = {}
+        for code, label in enumerate(self.labels):
+            if label == REST_LABEL or label == '':
+                self.colors[code] = None
+            elif label.endswith('不足'):
+                self.colors[code] = SHORTAGE_COLOR
+            else:
+                self.colors[code] = SHIFT_COLORS[(code - 1) % len(SHIFT_COLORS)]
+        self.first_column = 0
+        self.apply_filter()
+
+    def apply_filter(self, *args):
+        text = self.filter_var.get().strip()
+        if text:
+            self.rows = np.flatnonzero(pd.Series(self.names, dtype=object).astype(str).str.contains(text, regex=False).to_numpy())
+        else:
+            self.rows = np.arange(len(self.names))
+        self.first_row = 0
+        self.redraw()
+
+    def visible_rows(self):
+        return max((self.canvas.winfo_height() - 2 * self.HEADER_HEIGHT) // self.ROW_HEIGHT, 1)
+
+    def visible_columns(self):
+        return max((self.canvas.winfo_width() - self.NAME_WIDTH) // self.CELL_WIDTH, 1)
+
+    def scroll_position(self, action, value, unit, first, total, visible, step=1):
+        if action == 'moveto':
+            first = int(float(value) * total)
+        else:
+            first += int(value) * (visible if unit == 'pages' else step)
+        return max(0, min(first, total - visible))
+
+    def scroll_rows(self, action, value, unit=None, step=1):
+        self.first_row = self.scroll_position(action, value, unit, self.first_row, len(self.rows), self.visible_rows(), step)
+        self.redraw()
+
+    def scroll_columns(self, action, value, unit=None):
+        self.first_column = self.scroll_position(action, value, unit, self.first_column, len(self.days), self.visible_columns())
+        self.redraw()
+
+    def draw_cell(self, x, y, width, height, text, fill=None, bold=False):
+        self.canvas.create_rectangle(x, y, x + width, y + height, fill=fill or '', outline='#d4d4d8')
+        self.canvas.create_text(x + width / 2, y + height / 2, text=text, font=('Helvetica', 10, 'bold' if bold else 'normal'))
+
+    def redraw(self):
+        self.canvas.delete('all')
+        row_count, column_count = self.visible_rows(), self.visible_columns()
+        rows = self.rows[self.first_row:self.first_row + row_count]
+        columns = range(self.first_column, min(self.first_column + column_count, len(self.days)))
+        # 見出しの行と不足の行は常に上に表示する
+        self.draw_cell(0, 0, self.NAME_WIDTH, self.HEADER_HEIGHT, "名前", bold=True)
+        self.draw_cell(0, self.HEADER_HEIGHT, self.NAME_WIDTH, self.HEADER_HEIGHT, "不足", bold=True)
+        for k, column in enumerate(columns):
+            x = self.NAME_WIDTH + k * self.CELL_WIDTH
+            shortage = self.shortage_days[column]
+            self.draw_cell(x, 0, self.CELL_WIDTH, self.HEADER_HEIGHT, self.days[column], SHORTAGE_COLOR if shortage else None, bold=True)
+            self.draw_cell(x, self.HEADER_HEIGHT, self.CELL_WIDTH, self.HEADER_HEIGHT, self.labels[self.shortage_codes[column]], SHORTAGE_COLOR if shortage else None)
+        for r, row in enumerate(rows):
+            y = 2 * self.HEADER_HEIGHT + r * self.ROW_HEIGHT
+            self.draw_cell(0, y, self.NAME_WIDTH, self.ROW_HEIGHT, str(self.names[row]))
+            for k, column in enumerate(columns):
+                code = self.codes[row, column]
+                fill = self.colors[code] or (SHORTAGE_DAY_COLOR if self.shortage_days[column] else None)
+                self.draw_cell(self.NAME_WIDTH + k * self.CELL_WIDTH, y, self.CELL_WIDTH, self.ROW_HEIGHT, self.labels[code], fill)
+        self.vertical_bar.set(*self.scroll_fractions(self.first_row, len(rows), len(self.rows)))
+        self.horizontal_bar.set(*self.scroll_fractions(self.first_column, len(columns), len(self.days)))
+
+    def scroll_fractions(self, first, visible, total):
+        if total == 0:
+            return 0.0, 1.0
+        return first / total, (first + visible) / total
+
+class ShiftSchedulerApp:
+    def __init__(self, root):
+        self.root = root
+        # 同じファイルを同じ条件と乱数シードで作り直したときは、キャッシュからすぐに表示する
+        self.scheduler = ShiftScheduler(cache=ScheduleCache())
+        self.selected_file_path = None
+        self.shift_types = default_shift_types()
+        self.demand_table = None
+        self.demand_file_name = None
+        self.attempt_count = 1
+        self.worker_queue = queue.Queue()
+        self.cancel_event = None
+        self.results_window = None
+        self.schedule_grid = None
+        self.setup_ui()
+
+    def is_valid_number(self, value):
+        try:
+            return int(value) >= 0
+        except ValueError:
+            return False
+
+    def setup_ui(self):
+        self.root.title("シフトスケジュール作成ツール")
+        style = ttk.Style()
+        style.configure('TButton', font=('Helvetica', 12), padding=10)
+        style.configure('TLabel', font=('Helvetica', 12), padding=10)
+        self.file_path_label = ttk.Label(self.root, text="ファイルが選択されていません")
+        self.file_path_label.grid(row=0, column=0, columnspan=2, pady=10, padx=10, sticky="w")
+        self.select_file_button = ttk.Button(self.root, text="ファイルを選択", command=self.select_file)
+        self.shift_frame = ttk.Frame(self.root)
+        self.shift_frame.grid(row=3, column=0, columnspan=2, sticky="ew")
+        self.shift_frame.grid_columnconfigure(0, weight=1)
+        self.shift_frame.grid_columnconfigure(1, weight=1)
+        self.build_shift_spinners()
+        self.shift_types_button = ttk.Button(self.root, text="シフト定義を読み込む", command=self.select_shift_types)
+        self.shift_types_button.grid(row=4, column=0, pady=10, padx=10, sticky="ew")
+        self.demand_button = ttk.Button(self.root, text="必要人数表を読み込む", command=self.select_demand_table)
+        self.demand_button.grid(row=4, column=1, pady=10, padx=10, sticky="ew")
+        self.shift_types_label = ttk.Label(self.root, text="")
+        self.shift_types_label.grid(row=5, column=0, columnspan=2, pady=10, padx=10, sticky="w")
+        self.update_shift_types_label()
+        attempt_label = ttk.Label(self.root, text="試行回数")
+        attempt_label.grid(row=6, column=0, pady=10, padx=10, sticky="e")
+        self.attempt_spinner = ttk.Spinbox(self.root, from_=1, to=100, increment=1, wrap=True)
+        self.attempt_spinner.set(self.attempt_count)
+        self.attempt_spinner.grid(row=6, column=1, pady=10, padx=10, sticky="w")
+        seed_label = ttk.Label(self.root, text="乱数シード (空欄でランダム)")
+        seed_label.grid(row=7, column=0, pady=10, padx=10, sticky="e")
+        self.seed_entry = ttk.Entry(self.root)
+        self.seed_entry.grid(row=7, column=1, pady=10, padx=10, sticky="w")
+        self.incremental_var = tk.BooleanVar(value=False)
+        self.incremental_check = ttk.Checkbutton(self.root, text="変更のあった日だけ再割り当て", variable=self.incremental_var)
+        self.incremental_check.grid(row=8, column=1, pady=10, padx=10, sticky="w")
+        self.show_button = ttk.Button(self.root, text="結果を表示", command=self.show_results)
+        self.show_button.grid(row=8, column=0, pady=10, padx=10, sticky="ew")
+        self.select_file_button.grid(row=1, column=0, pady=10, padx=10, sticky="ew")
+        self.start_button = ttk.Button(self.root, text="シフト割り当て開始", command=self.start_shift_assignment)
+        self.start_button.grid(row=1, column=1, pady=10, padx=10, sticky="ew")
+        self.save_button = ttk.Button(self.root, text="結果を保存", command=self.save_results)
+        self.save_button.grid(row=2, column=0, pady=10, padx=10, sticky="ew")
+        self.exit_button = ttk.Button(self.root, text="終了", command=self.exit_application)
+        self.exit_button.grid(row=2, column=1, pady=10, padx=10, sticky="ew")
+        self.progress_bar = ttk.Progressbar(self.root, orient="horizontal", mode="determinate")
+        self.progress_bar.grid(row=9, column=0, pady=10, padx=10, sticky="ew")
+        self.cancel_button = ttk.Button(self.root, text="中止", command=self.cancel_shift_assignment, state="disabled")
+        self.cancel_button.grid(row=9, column=1, pady=10, padx=10, sticky="ew")
+        self.status_label = ttk.Label(self.root, text="")
+        self.status_label.grid(row=10, column=0, columnspan=2, pady=10, padx=10, sticky="w")
+        self.root.grid_rowconfigure(1, weight=1)
+        self.root.grid_rowconfigure(2, weight=1)
+        self.root.grid_columnconfigure(0, weight=1)
+        self.root.grid_columnconfigure(1, weight=1)
+        self.resize_window()
+
+    def build_shift_spinners(self):
+        # シフトの種類ごとに必要人数の入力欄を作る
+        for widget in self.shift_frame.winfo_children():
+            widget.destroy()
+        self.shift_spinners = []
+        for row, shift_type in enumerate(self.shift_types):
+            label = ttk.Label(self.shift_frame, text=f"{shift_type.label}の必要人数")
+            label.grid(row=row, column=0, pady=10, padx=10, sticky="e")
+            spinner = ttk.Spinbox(self.shift_frame, from_=0, to=10, increment=1, wrap=True)
+            spinner.set(shift_type.demand)
+            spinner.grid(row=row, column=1, pady=10, padx=10, sticky="w")
+            self.shift_spinners.append(spinner)
+
+    def resize_window(self):
+        self.root.geometry(f'600x{730 + 60 * (len(self.shift_types) - 2)}')
+        self.center_window()
+
+    def center_window(self):
+        self.root.update_idletasks()
+        width = self.root.winfo_width()
+        height = self.root.winfo_height()
+        screen_width = self.root.winfo_screenwidth()
+        screen_height = self.root.winfo_screenheight()
+        x = int((screen_width / 2) - (width / 2))
+        y = int((screen_height / 2) - (height / 2))
+        self.root.geometry(f'{width}x{height}+{x}+{y}')
+
+    def select_file(self):
+        file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
+        if file_path:
+            self.selected_file_path = file_path
+            filename = os.path.basename(file_path)
+            self.file_path_label.config(text=filename)
+
+    def select_shift_types(self):
+        file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
+        if not file_path:
+            return
+        try:
+            self.shift_types = load_shift_types(file_path)
+        except Exception as e:
+            messagebox.showerror("エラー", str(e))
+            return
+        self.update_shift_types_label()
+        self.build_shift_spinners()
+        self.resize_window()
+
+    def select_demand_table(self):
+        file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
+        if not file_path:
+            return
+        try:
+            self.demand_table = load_demand_table(file_path)
+        except Exception as e:
+            messagebox.showerror("エラー", str(e))
+            return
+        self.demand_file_name = os.path.basename(file_path)
+        self.update_shift_types_label()
+
+    def update_shift_types_label(self):
+        # 必要人数表に書かれていない日は、上の入力欄の人数を使う
+        text = f"シフト: {'・'.join(shift_type.label for shift_type in self.shift_types)}"
+        text += f" / 必要人数表: {self.demand_file_name}" if self.demand_file_name else " / 必要人数表: なし"
+        self.shift_types_label.config(text=text)
+
+    def start_shift_assignment(self):
+        if self.selected_file_path is None:
+            messagebox.showwarning("警告", "ファイルが選択されていません。")
+            return
+        demands = [spinner.get() for spinner in self.shift_spinners]
+        if not all(self.is_valid_number(demand) for demand in demands):
+            messagebox.showerror("エラー", f"{'または'.join(shift_type.label for shift_type in self.shift_types)}の人数に無効な値が設定されています。")
+            return
+        attempt_count = self.attempt_spinner.get()
+        if not self.is_valid_number(attempt_count) or int(attempt_count) < 1:
+            messagebox.showerror("エラー", "試行回数に無効な値が設定されています。")
+            return
+        seed = self.seed_entry.get().strip()
+        if seed and not (seed.isdigit() and int(seed) < 2 ** 32):
+            messagebox.showerror("エラー", "乱数シードに無効な値が設定されています。")
+            return
+        shift_types = [shift_type._replace(demand=int(demand)) for shift_type, demand in zip(self.shift_types, demands)]
+        attempt_count = int(attempt_count)
+        seed = int(seed) if seed else None
+        self.cancel_event = threading.Event()
+        self.set_running(True)
+        self.progress_bar.config(value=0, maximum=1)
+        worker = threading.Thread(target=self.run_shift_assignment, args=(self.selected_file_path, shift_types, self.demand_table, attempt_count, seed, self.incremental_var.get(), self.cancel_event), daemon=True)
+        worker.start()
+        self.root.after(100, self.poll_worker)
+
+    def run_shift_assignment(self, file_path, shift_types, demand_table, attempt_count, seed, incremental, cancel_event):
+        self.scheduler.reset_metrics()
+        try:
+            cache_hit = False
+            if incremental and self.scheduler.last_run is not None:
+                preferences = self.scheduler.load_preferences(file_path, shift_types)
+                self.scheduler.update_shift_schedule(preferences, shift_types, progress=self.report_progress, cancel_event=cancel_event, demand_table=demand_table, seed=seed)
+            else:
+                cache_hit = self.scheduler.schedule_from_file(file_path, shift_types, seed=seed, attempts=attempt_count, progress=self.report_progress, cancel_event=cancel_event, demand_table=demand_table)
+            self.worker_queue.put(('done', (self.scheduler.seed, cache_hit)))
+        except ScheduleCancelled:
+            self.worker_queue.put(('cancelled', None))
+        except Exception as e:
+            self.worker_queue.put(('error', e))
+
+    def report_progress(self, done, total):
+        self.worker_queue.put(('progress', (done, total)))
+
+    def poll_worker(self):
+        while True:
+            try:
+                kind, payload = self.worker_queue.get_nowait()
+            except queue.Empty:
+                self.root.after(100, self.poll_worker)
+                return
+            if kind == 'progress':
+                done, total = payload
+                self.progress_bar.config(value=done, maximum=total)
+                continue
+            self.set_running(False)
+            self.status_label.config(text=self.scheduler.metrics.summary())
+            if kind == 'done':
+                self.show_results()
+                seed, cache_hit = payload
+                if seed is None:
+                    message = "変更のあった日だけシフトを再割り当てしました。(前回の結果を引き継いでいるため、乱数シードでは再現できません)"
+                else:
+                    message = f"シフト割り当てが完了しました。(乱数シード: {seed}{'、キャッシュから表示' if cache_hit else ''})"
+                if self.scheduler.issues:
+                    issues = '\n'.join(summarize_issues(self.scheduler.issues))
+                    messagebox.showwarning("完了", f"{message}\n\n入力ファイルの確認事項:\n{issues}")
+                else:
+                    messagebox.showinfo("完了", message)
+            elif kind == 'cancelled':
+                self.progress_bar.config(value=0)
+                messagebox.showinfo("中止", "シフト割り当てを中止しました。")
+            else:
+                messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました: {payload}")
+            return
+
+    def cancel_shift_assignment(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_button.state(['disabled'])
+
+    def set_running(self, running):
+        for button in (self.select_file_button, self.shift_types_button, self.demand_button, self.start_button, self.save_button, self.show_button, self.incremental_check, self.seed_entry):
+            button.state(['disabled'] if running else ['!disabled'])
+        self.cancel_button.state(['!disabled'] if running else ['disabled'])
+
+    def save_results(self):
+        if self.scheduler.shift_schedule is None:
+            messagebox.showwarning("警告", "まだシフト割り当てが行われていません。")
+            return
+        save_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=SAVE_FILE_TYPES)
+        if save_path:
+            try:
+                self.scheduler.save_schedule(save_path)
+            except Exception as e:
+                messagebox.showerror("エラー", f"シフト表の保存に失敗しました: {e}")
+                return
+            self.status_label.config(text=self.scheduler.metrics.summary())
+            messagebox.showinfo("保存", "シフト表を保存しました。")
+
+    def show_results(self):
+        if self.scheduler.shift_schedule is None:
+            messagebox.showwarning("警告", "まだシフト割り当てが行われていません。")
+            return
+        if self.results_window is None or not self.results_window.winfo_exists():
+            self.results_window = tk.Toplevel(self.root)
+            self.results_window.title("シフト表")
+            self.results_window.geometry('900x600')
+            self.schedule_grid = ScheduleGrid(self.results_window)
+            self.schedule_grid.frame.pack(fill="both", expand=True, padx=10, pady=10)
+        self.schedule_grid.set_schedule(self.scheduler.shift_schedule)
+        self.results_window.lift()
+
+    def exit_application(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        self.root.destroy()
+
+def run_app():
+    root = tk.Tk()
+    app = ShiftSchedulerApp(root)
+    root.mainloop()
+
+if __name__ == "__main__":
+    run_app()
@@ -0,0 +1,357 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from shift_scheduler import DAY_LABEL_PATTERN, DEFAULT_SHIFT_HOURS, SCHEDULE_WRITERS, SOLVERS, ShiftType, WorkloadLimits, default_shift_types, parse_month, schedule_file, validate_shift_types
+
+HTTP_STATUS = {
+    200: 'OK',
+    201: 'Created',
+    202: 'Accepted',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+    'feather': 'application/vnd.apache.arrow.file',
+}
+JOB_PATH = re.compile(r'^/jobs/(?P<job_id>[0-9a-f]{32})(?P<result>/result)?$')
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+def job_parameters(payload):
+    # JSONで受け取ったパラメータを schedule_file の引数に変換する
+    if 'shift_types' in payload:
+        shift_types = [ShiftType(item['label'], int(item['demand']), tuple(item.get('fillable') or (item['label'], '終日可能')), float(item.get('hours', DEFAULT_SHIFT_HOURS)))
+                       for item in payload['shift_types']]
+    else:
+        shift_types = default_shift_types(int(payload.get('early', 2)), int(payload.get('late', 2)))
+    validate_shift_types(shift_types)
+    solver = payload.get('solver', 'random')
+    if solver not in SOLVERS:
+        raise ValueError(f"不明なソルバーです: {solver}")
+    attempts = int(payload.get('attempts', 1))
+    if attempts < 1:
+        raise ValueError("試行回数は1以上を指定してください。")
+    file_format = payload.get('format', 'csv')
+    if file_format not in SCHEDULE_WRITERS:
+        raise ValueError(f"不明な出力形式です: {file_format}")
+    target_hours = payload.get('target_hours') or {}
+    if target_hours and solver != 'fair':
+        raise ValueError("target_hoursはsolverがfairの場合だけ指定できます。")
+    if not isinstance(target_hours, dict):
+        raise ValueError("target_hoursは {名前: 時間} の形で指定してください。")
+    target_hours = {str(name): float(hours) for name, hours in target_hours.items()}
+    if any(hours <= 0 for hours in target_hours.values()):
+        raise ValueError("目標時間は0より大きい値を指定してください。")
+    limits = None
+    if payload.get('limits'):
+        limits = WorkloadLimits(**payload['limits'])
+    return {
+        'shift_types': shift_types,
+        'solver': solver,
+        'attempts': attempts,
+        'seed': None if payload.get('seed') is None else int(payload['seed']),
+        'file_format': file_format,
+        'start_date': parse_month(payload['start_month']) if payload.get('start_month') else None,
+        'limits': limits,
+        'demand_table': demand_parameter(payload.get('demand'), shift_types),
+        'target_hours': target_hours or None,
+    }
+
+def demand_parameter(demand, shift_types):
+    # {日付: {シフト名: 人数}} の形で、シフト名がシフト定義にあり、人数が0以上の整数であることを確かめる
+    if not demand:
+        return None
+    if not isinstance(demand, dict) or not all(isinstance(counts, dict) for counts in demand.values()):
+        raise ValueError("demandは {日付: {シフト名: 人数}} の形で指定してください。")
+    labels = {shift_type.label for shift_type in shift_types}
+    for day, counts in demand.items():
+        if DAY_LABEL_PATTERN.match(day) is None:
+            raise ValueError(f"必要人数表の日付が正しくありません: {day}")
+        for label, count in counts.items():
+            if label not in labels:
+                raise ValueError(f"必要人数表に不明なシフトがあります: {label}")
+            if isinstance(count, bool) or not isinstance(count, int) or count < 0:
+                raise ValueError(f"必要人数表の人数に無効な値が設定されています: {day} {label}")
+    return demand
+
+def run_job(file_path, output_path, parameters):
+    # ワーカープロセスで実行する。待ち時間と分けて計るため、ここでの経過時間も返す
+    start = time.perf_counter()
+    shortage_days, shortage_count, seed, _, elapsed, warnings = schedule_file(
+        file_path, output_path, parameters['shift_types'], parameters['solver'], parameters['attempts'], parameters['seed'],
+        file_format=parameters['file_format'], start_date=parameters['start_date'], limits=parameters['limits'], demand_table=parameters['demand_table'], target_hours=parameters['target_hours'])
+    return {'shortage_days': shortage_days, 'shortage_count': shortage_count, 'seed': seed, 'warnings': warnings, 'scheduler_seconds': elapsed, 'worker_seconds': time.perf_counter() - start}
+
+class SchedulingService:
+    # asyncioで受け付けたジョブを、プロセス数と同じ数のディスパッチャーがプロセスプールに渡す。
+    # 待ち行列が一杯のときは 503 を返して、クライアントに後で送り直してもらう
+    def __init__(self, work_dir, workers=None, queue_size=16, max_upload_bytes=64 * 1024 * 1024, max_jobs=1000):
+        self.work_dir = work_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.max_upload_bytes = max_upload_bytes
+        self.max_jobs = max_jobs
+        self.uploads = OrderedDict()
+        self.jobs = OrderedDict()
+        self.running = 0
+        self.queue = None
+        self.executor = None
+        self.server = None
+        self.dispatchers = []
+        os.makedirs(os.path.join(work_dir, 'uploads'), exist_ok=True)
+        os.makedirs(os.path.join(work_dir, 'results'), exist_ok=True)
+
+    async def start(self, host='127.0.0.1', port=8000):
+        from concurrent.futures import ProcessPoolExecutor
+        self.queue = asyncio.Queue(self.queue_size)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        # ワーカーは最初のジョブのときに作られるため、その時点で開いている接続のソケットを引き継いで
+        # 接続が閉じなくなる。待ち受けを始める前に、空の処理を渡してすべてのワーカーを作っておく
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, os.getpid) for _ in range(self.workers)))
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+            self.running += 1
+            try:
+                job['result'] = await loop.run_in_executor(self.executor, run_job, job['input_path'], job['output_path'], job['parameters'])
+                job['status'] = 'done'
+            except Exception as e:
+                job['status'] = 'failed'
+                job['error'] = str(e)
+            finally:
+                job['finished_at'] = time.time()
+                self.running -= 1
+                self.queue.task_done()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                method, path, headers, body = await self.read_request(reader)
+                status, response_headers, response_body = await self.route(method, path, headers, body)
+            except HTTPError as e:
+                status, response_headers, response_body = e.status, e.headers, json_body({'error': str(e)})
+            except Exception as e:
+                status, response_headers, response_body = 500, {}, json_body({'error': str(e)})
+            response_headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+            head = [f'HTTP/1.1 {status} {HTTP_STATUS[status]}', f'Content-Length: {len(response_body)}', 'Connection: close']
+            head.extend(f'{name}: {value}' for name, value in response_headers.items())
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + response_body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "リクエストヘッダーが大きすぎます。")
+        except asyncio.IncompleteReadError:
+            raise ConnectionError()
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, "リクエストの形式が正しくありません。")
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            raise HTTPError(411, "Content-Lengthを指定してください。")
+        try:
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Content-Lengthが正しくありません。")
+        if length < 0:
+            raise HTTPError(400, "Content-Lengthが正しくありません。")
+        if length > self.max_upload_bytes:
+            raise HTTPError(413, f"アップロードできるのは{self.max_upload_bytes}バイトまでです。")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), urlsplit(target).path, headers, body
+
+    async def route(self, method, path, headers, body):
+        if path == '/health':
+            return self.require(method, 'GET') or (200, {}, json_body(self.health()))
+        if path == '/uploads':
+            return self.require(method, 'POST') or await self.create_upload(body)
+        if path == '/jobs':
+            return self.require(method, 'POST') or self.create_job(body)
+        match = JOB_PATH.match(path)
+        if match is None or match.group('job_id') not in self.jobs:
+            raise HTTPError(404, "見つかりません。")
+        job = self.jobs[match.group('job_id')]
+        if match.group('result'):
+            return self.require(method, 'GET') or await self.job_result(job)
+        return self.require(method, 'GET') or (200, {}, json_body(self.job_status(job)))
+
+    def require(self, method, expected):
+        if method != expected:
+            raise HTTPError(405, "このメソッドは使えません。", {'Allow': expected})
+        return None
+
+    def health(self):
+        return {'workers': self.workers, 'running': self.running, 'queued': self.queue.qsize(), 'queue_size': self.queue_size, 'jobs': len(self.jobs)}
+
+    async def create_upload(self, body):
+        if not body:
+            raise HTTPError(400, "希望シフトのCSVを送ってください。")
+        upload_id = uuid.uuid4().hex
+        file_path = os.path.join(self.work_dir, 'uploads', f'{upload_id}.csv')
+        await asyncio.to_thread(write_file, file_path, body)
+        self.uploads[upload_id] = file_path
+        while len(self.uploads) > self.max_jobs:
+            _, old_path = self.uploads.popitem(last=False)
+            remove_file(old_path)
+        return 201, {}, json_body({'upload_id': upload_id, 'bytes': len(body)})
+
+    def create_job(self, body):
+        try:
+            payload = json.loads(body or b'{}')
+            if not isinstance(payload, dict):
+                raise ValueError("JSONのオブジェクトを送ってください。")
+            parameters = job_parameters(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            raise HTTPError(400, f"パラメータが正しくありません: {e}")
+        input_path = self.uploads.get(payload.get('upload_id'))
+        if input_path is None:
+            raise HTTPError(404, "アップロードされたファイルが見つかりません。")
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'status': 'queued',
+            'input_path': input_path,
+            'output_path': os.path.join(self.work_dir, 'results', f"{job_id}.{parameters['file_format']}"),
+            'parameters': parameters,
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+        }
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPError(503, "混み合っています。しばらくしてから送り直してください。", {'Retry-After': '5'})
+        self.jobs[job_id] = job
+        self.evict_jobs()
+        return 202, {'Location': f'/jobs/{job_id}'}, json_body(self.job_status(job))
+
+    def evict_jobs(self):
+        # 終わったジョブから古い順に消し、メモリと作業ディレクトリが増え続けないようにする
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ('done', 'failed')]
+        for job_id in finished[:max(len(self.jobs) - self.max_jobs, 0)]:
+            remove_file(self.jobs.pop(job_id)['output_path'])
+
+    def job_status(self, job):
+        status = {'job_id': job['job_id'], 'status': job['status'], 'error': job['error']}
+        if job['result'] is not None:
+            status.update({key: job['result'][key] for key in ('shortage_days', 'shortage_count', 'seed', 'warnings')})
+            status['result_url'] = f"/jobs/{job['job_id']}/result"
+        timing = {}
+        if job['started_at'] is not None:
+            timing['queued_seconds'] = round(job['started_at'] - job['submitted_at'], 4)
+        if job['finished_at'] is not None:
+            timing['running_seconds'] = round(job['finished_at'] - job['started_at'], 4)
+            timing['total_seconds'] = round(job['finished_at'] - job['submitted_at'], 4)
+        if job['result'] is not None:
+            timing['scheduler_seconds'] = round(job['result']['scheduler_seconds'], 4)
+            timing['worker_seconds'] = round(job['result']['worker_seconds'], 4)
+        status['timing'] = timing
+        return status
+
+    async def job_result(self, job):
+        if job['status'] != 'done':
+            raise HTTPError(409, "シフト表はまだ作成されていません。")
+        file_format = job['parameters']['file_format']
+        body = await asyncio.to_thread(read_file, job['output_path'])
+        headers = {'Content-Type': CONTENT_TYPES[file_format], 'Content-Disposition': f"attachment; filename=\"shift_schedule.{file_format}\""}
+        return 200, headers, body
+
+def json_body(data):
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+def write_file(file_path, data):
+    with open(file_path, 'wb') as f:
+        f.write(data)
+
+def read_file(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+def remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+async def serve(host, port, work_dir, workers=None, queue_size=16):
+    service = SchedulingService(work_dir, workers=workers, queue_size=queue_size)
+    address = await service.start(host, port)
+    print(f"http://{address[0]}:{address[1]} で待ち受けています (プロセス数 {service.workers}, 待ち行列 {queue_size})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.close()
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="シフト作成のHTTPサービス。希望シフトCSVをアップロードし、ジョブとしてシフト表を作成します。")
+    parser.add_argument('--host', default='127.0.0.1', help="待ち受けるアドレス (デフォルト: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8000, help="待ち受けるポート (デフォルト: 8000)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="シフト作成に使うプロセス数 (デフォルト: CPUコア数)")
+    parser.add_argument('--queue-size', type=int, default=16, help="実行待ちにできるジョブの数。超えた分は503を返します (デフォルト: 16)")
+    parser.add_argument('--work-dir', default=None, help="アップロードと結果を置くディレクトリ (デフォルト: 一時ディレクトリ)")
+    args = parser.parse_args(argv)
+    if args.queue_size < 1:
+        parser.error("待ち行列の長さは1以上を指定してください。")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            asyncio.run(serve(args.host, args.port, args.work_dir or temp_dir, args.workers, args.queue_size))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
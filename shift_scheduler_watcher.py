@@ -0,0 +1,116 @@
+import os
+import random
+import signal
+import threading
+import time
+from shift_scheduler import print_summary_row, schedule_file, summary_frame, summary_row
+
+def init_worker():
+    # Ctrl+Cは親プロセスだけで受け取り、実行中のジョブを止めてから終了する
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    random.seed()
+
+class InboxWatcher:
+    # 受信ディレクトリを定期的に確認し、書き込みが終わったCSVだけをプロセスプールに渡す。
+    # 同時に渡すのはプロセス数の2倍までにして、残りはディレクトリに置いたまま次の確認で拾う
+    def __init__(self, inbox, outbox, shift_types, workers=None, poll_interval=1.0, settle_seconds=2.0, solver='random', attempts=1, seed=None,
+                 cache_dir=None, file_format='csv', start_date=None, limits=None, demand_table=None, history_path=None, target_hours=None):
+        self.inbox = inbox
+        self.outbox = outbox
+        self.shift_types = shift_types
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.solver = solver
+        self.attempts = attempts
+        self.seed = seed
+        self.cache_dir = cache_dir
+        self.file_format = file_format
+        self.start_date = start_date
+        self.limits = limits
+        self.demand_table = demand_table
+        self.history_path = history_path
+        self.target_hours = target_hours
+        # パスごとに (サイズ, 更新時刻) を覚えておく。ディレクトリから消えたファイルは忘れる
+        self.seen = {}
+        self.done = {}
+        self.running = {}
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def scan(self):
+        # 前回の確認から大きさも更新時刻も変わらず、最後の更新から settle_seconds 経ったものを書き込み済みとみなす
+        now = time.time()
+        ready = []
+        present = set()
+        with os.scandir(self.inbox) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.name.lower().endswith('.csv'):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                present.add(entry.path)
+                previous, self.seen[entry.path] = self.seen.get(entry.path), signature
+                if previous != signature or self.done.get(entry.path) == signature:
+                    continue
+                if now - stat.st_mtime >= self.settle_seconds:
+                    ready.append((stat.st_mtime_ns, entry.path, signature))
+        for path in self.seen.keys() - present:
+            del self.seen[path]
+            self.done.pop(path, None)
+        ready.sort()
+        return [(path, signature) for _, path, signature in ready]
+
+    def submit_ready(self, executor):
+        running_paths = {path for path, _, _, _ in self.running.values()}
+        for path, signature in self.scan():
+            if len(self.running) >= self.workers * 2:
+                break
+            if path in running_paths:
+                continue
+            store = os.path.splitext(os.path.basename(path))[0]
+            output_path = os.path.join(self.outbox, f'{store}_shift_schedule.{self.file_format}')
+            # 書き込み途中のシフト表を読まれないよう、隠しファイルに書いてから置き換える
+            temp_path = os.path.join(self.outbox, f'.{store}_shift_schedule.{self.file_format}')
+            future = executor.submit(schedule_file, path, temp_path, self.shift_types, self.solver, self.attempts, self.seed, self.cache_dir,
+                                     None, False, self.file_format, self.start_date, self.limits, self.demand_table, self.history_path, self.target_hours)
+            self.running[future] = (path, signature, temp_path, output_path)
+
+    def finish(self, future):
+        path, signature, temp_path, output_path = self.running.pop(future)
+        # 失敗したファイルも、書き直されるまでは再実行しない
+        self.done[path] = signature
+        row = summary_row(os.path.splitext(os.path.basename(path))[0], future)
+        if row['エラー']:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        else:
+            os.replace(temp_path, output_path)
+        summary_path = os.path.join(self.outbox, 'summary.csv')
+        summary = summary_frame([row])
+        summary.to_csv(summary_path, mode='a', header=not os.path.exists(summary_path), index=False)
+        print_summary_row(next(summary.itertuples(index=False)))
+        return row
+
+    def run(self):
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        os.makedirs(self.outbox, exist_ok=True)
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        try:
+            while not self.stop_event.is_set():
+                self.submit_ready(executor)
+                if self.running:
+                    finished, _ = wait(self.running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self.finish(future)
+                else:
+                    self.stop_event.wait(self.poll_interval)
+        finally:
+            executor.shutdown(cancel_futures=True)